@@ -1,52 +1,628 @@
 from heapq import merge
 import sys
-from unicodedata import category
 import os
 import csv
 import argparse
-from collections import defaultdict, OrderedDict
+from array import array
+from collections import defaultdict, OrderedDict, deque
 import hashlib
+import io
+import itertools
+import json
+import math
+import mmap
+import operator
+import pickle
+import re
+import zlib
+import codecs
+import cProfile
+import gc
+import pstats
+import queue
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import lru_cache
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows; peak memory is not reported there
 
 
 # === Global Constants ===
 QUOTE_CHAR = '\xfe'  # Quote character used to enclose fields.
 FIELD_SEP = '\x14'  # Field separator (DC4)
 EXPORT_ENCODING = 'utf-16'
+READ_BLOCK_SIZE = 4 * 1024 * 1024  # Characters read per block by the record scanner
+DEFAULT_MEMORY_BUDGET_MB = 1024  # In-memory index or sort size allowed before spilling to temp files
+SPILL_BATCH_ROWS = 1000  # Rows pickled together in temp files
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes buffered by output files
+WRITE_BATCH_ROWS = 2000  # Rows formatted and encoded together by RowWriter
+
+# === Record Scanner Class ===
+class RecordScanner:
+    """
+    Splits a text stream into logical DAT records.
+    Reads the stream in large blocks and jumps between quote tokens with compiled
+    regex searches instead of stepping through it one character at a time.
+    Given a codec, it scans an undecoded binary stream instead and yields records as
+    bytes, treating CR LF, CR and LF each as one line break like universal newlines do.
+    """
+    # Closing quote followed by a field separator or a newline and the next opening quote
+    TOKEN = re.compile(QUOTE_CHAR + '[' + FIELD_SEP + '\n]' + QUOTE_CHAR)
+    # Outside a quoted field only quotes and line breaks are significant
+    OUTSIDE = re.compile('[' + QUOTE_CHAR + '\r\n]')
+    RECORD_END = re.compile(QUOTE_CHAR + '\n' + QUOTE_CHAR)
+    byte_patterns = {}  # codec -> (quote, TOKEN, OUTSIDE, RECORD_END) for binary streams
+
+    def __init__(self, file, block_size=READ_BLOCK_SIZE, codec=None, offsets=None, base=0):
+        self.file = file
+        self.block_size = block_size
+        self.offsets = offsets  # If given, the start offset of each record is appended to it
+        self.base = base  # Stream offset of the first character read
+        if codec is None:
+            self.quote, self.token, self.outside, self.record_end = QUOTE_CHAR, self.TOKEN, self.OUTSIDE, self.RECORD_END
+        else:
+            if codec not in self.byte_patterns:
+                quote = re.escape(QUOTE_CHAR.encode(codec))
+                self.byte_patterns[codec] = (
+                    QUOTE_CHAR.encode(codec),
+                    re.compile(quote + b'(?:\x14|\r\n|\r|\n)' + quote),
+                    re.compile(quote + b'|\r\n|\r|\n'),
+                    re.compile(quote + b'(?:\r\n|\r|\n)' + quote),
+                )
+            self.quote, self.token, self.outside, self.record_end = self.byte_patterns[codec]
+
+    def __iter__(self):
+        read = self.file.read
+        block_size = self.block_size
+        quote = self.quote
+        qlen = len(quote)
+        offsets = self.offsets
+        buf = read(block_size)
+        empty = buf[:0]
+        if isinstance(empty, bytes):
+            sep, crlf = FIELD_SEP.encode('ascii'), b'\r\n'
+        else:
+            sep, crlf = FIELD_SEP, '\r\n'
+        sep_quote = sep + quote
+        quote_sep = quote + sep
+        retry_at = 0  # Do not look for a record end again before this position
+        eof = not buf
+        parts = []  # Pieces of the current record carried over from earlier blocks
+        base = self.base  # Stream offset of buf[0]
+        record_start = base  # Stream offset of the current record
+        start = 0  # Start of the current record in buf
+        pos = 0  # Scan position in buf
+        in_quote = False  # Track whether we are inside a quoted field
+
+        while True:
+            if in_quote:
+                if pos >= retry_at:
+                    e = self.record_end.search(buf, pos)
+                    if e is None:
+                        retry_at = len(buf) + 1
+                    elif e.start() - qlen - 1 < pos or buf[e.start() - qlen - 1:e.start()] != quote_sep:
+                        # The first record end ahead is not the tail of a field separator,
+                        # so every token before it is a field boundary: jump straight there
+                        c = e.start()
+                        parts.append(buf[start:c + qlen])
+                        if offsets is not None:
+                            offsets.append(record_start)
+                        yield empty.join(parts).strip(crlf)
+                        parts = []
+                        start = e.end() - qlen
+                        record_start = base + start
+                        pos = e.end()
+                        continue
+                    else:
+                        retry_at = e.start() + 1  # Step token by token past the ambiguous spot
+                m = self.token.search(buf, pos)
+            else:
+                m = self.outside.search(buf, pos)
+                if m and m.group() != quote and len(buf) < m.end() + 1 + qlen and not eof:
+                    m = None  # A line break needs a separator and a quote of lookahead
+            if m is None:
+                if eof:
+                    break
+                # Keep the tail of the buffer, it may start a token that crosses the block boundary
+                keep = max(pos, len(buf) - 2 * qlen - 1) if in_quote else pos
+                keep = max(keep, start)
+                parts.append(buf[start:keep])
+                block = read(block_size)
+                eof = not block
+                buf = buf[keep:] + block
+                base += keep
+                start = pos = retry_at = 0
+                continue
+
+            i = m.start()
+            if not in_quote:
+                if m.group() == quote:
+                    in_quote = True
+                    pos = i + qlen
+                elif buf[m.end():m.end() + 1 + qlen] == sep_quote:
+                    pos = m.end()
+                else:
+                    parts.append(buf[start:i])
+                    if offsets is not None:
+                        offsets.append(record_start)
+                    yield empty.join(parts).strip(crlf)
+                    parts = []
+                    start = pos = m.end()
+                    record_start = base + start
+            elif buf[i + qlen:i + qlen + 1] == sep:
+                pos = m.end()  # Field boundary, the next field opens straight away
+            else:
+                # Closing quote, newline and the opening quote of the next record
+                parts.append(buf[start:i + qlen])
+                if offsets is not None:
+                    offsets.append(record_start)
+                yield empty.join(parts).strip(crlf)
+                parts = []
+                start = m.end() - qlen
+                record_start = base + start
+                pos = m.end()
+
+        parts.append(buf[start:])
+        record = empty.join(parts)
+        if record:
+            if offsets is not None:
+                offsets.append(record_start)
+            yield record.strip(crlf)
+
+
+def decode_field(field, codec, errors='strict'):
+    """Decodes a raw field value, translating line breaks the way text mode does."""
+    text = field.decode(codec, errors)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+# === Instrumentation ===
+PROGRESS_INTERVAL = 0.5  # Seconds between progress updates
+PROGRESS_CHECK_RECORDS = 256  # Records between clock checks for progress
+STAGE_SAMPLE_INTERVAL = 0.001  # Seconds between looks at the stage each thread is in
+STAGES = ("detect encoding", "scan", "parse", "compare", "sort", "join", "column stats", "write")
+METRICS = None  # RunMetrics of this run, set by --stats, --progress or --profile-stage
+
+
+class RunMetrics:
+    """
+    Time spent per stage, bytes and records read, and optional live progress of a run.
+    Stage times are exclusive: while the writer pulls a parsed row, the time goes to
+    parse (and to scan, for the record scanner underneath it), not to write.
+    Each record only pushes and pops its stage on the stack of its thread; a sampler
+    thread charges the time since its last look, about every STAGE_SAMPLE_INTERVAL
+    seconds, to the innermost stage of each thread. So timing costs little per
+    record, and on one thread the stages and "other" add up to the run time.
+    Each thread times its own stages, so with --pipeline the stages overlap and can
+    add up to more than the run time.
+    With profile_stage set, cProfile runs only while that stage is the innermost one
+    of the main thread.
+    """
+    def __init__(self, progress=False, profile_stage=None):
+        self.pid = os.getpid()
+        self.started = time.perf_counter()
+        self.local = threading.local()
+        self.threads = []  # (stage stack, stage times) of each thread that timed a stage
+        self.bytes_read = 0
+        self.records_scanned = 0
+        self.records_parsed = 0
+        self.malformed = 0
+        self.show_progress = progress
+        self.last_progress = 0.0
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage else None
+        self.profiling = False
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self.sample, name="stage-sampler", daemon=True)
+        self.sampler.start()
+
+    def thread_state(self):
+        """The stage stack and stage times of the calling thread."""
+        local = self.local
+        if not hasattr(local, "stack"):
+            local.stack = []  # Names of the stages being timed, innermost last
+            local.seconds = defaultdict(float)  # Only the sampler adds to these
+            self.threads.append((local.stack, local.seconds))
+        return local
+
+    def sample(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(STAGE_SAMPLE_INTERVAL):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            for stack, seconds in list(self.threads):
+                try:
+                    stage = stack[-1]
+                except IndexError:
+                    continue  # Not in a stage: "other"
+                seconds[stage] += elapsed
+
+    def stage_seconds(self):
+        seconds = defaultdict(float)
+        for _, thread_seconds in list(self.threads):
+            for stage, s in list(thread_seconds.items()):
+                seconds[stage] += s
+        return seconds
+
+    def enter(self, stage):
+        stack = self.thread_state().stack
+        stack.append(stage)
+        if self.profiler is not None:
+            self.switch_profiler(stack)
+
+    def leave(self):
+        stack = self.thread_state().stack
+        stack.pop()
+        if self.profiler is not None:
+            self.switch_profiler(stack)
+
+    def switch_profiler(self, stack):
+        if threading.current_thread() is not threading.main_thread():
+            return
+        wanted = bool(stack) and stack[-1] == self.profile_stage
+        if wanted != self.profiling:
+            if wanted:
+                self.profiler.enable()
+            else:
+                self.profiler.disable()
+            self.profiling = wanted
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def timed_records(self, records, stage, progress=None):
+        """
+        Yields from records, timing each step as stage. Scan stages count records and,
+        with progress=(path, binary file), bytes read and live progress; parse stages
+        count records and malformed ones (None).
+        """
+        records = iter(records)
+        total = os.path.getsize(progress[0]) if progress else 0
+        file_started = time.perf_counter()
+        count = 0
+        finished = False
+        stack = self.thread_state().stack  # Of the thread iterating
+        profiled = self.profiler is not None
+        count_malformed = stage == "parse"
+        show_progress = bool(progress) and self.show_progress
+        # The stage is on the stack while records runs, and off it while the consumer does
+        stack.append(stage)
+        inside = True
+        try:
+            if profiled:
+                self.switch_profiler(stack)
+            for item in records:
+                stack.pop()
+                inside = False
+                if profiled:
+                    self.switch_profiler(stack)
+                count += 1
+                if count_malformed and item is None:
+                    self.malformed += 1
+                if show_progress and count % PROGRESS_CHECK_RECORDS == 0:
+                    self.print_progress(progress[0], progress[1].tell(), total, file_started)
+                yield item
+                stack.append(stage)
+                inside = True
+                if profiled:
+                    self.switch_profiler(stack)
+            finished = True
+        finally:
+            if inside:
+                stack.pop()
+                if profiled:
+                    self.switch_profiler(stack)
+            # Also reached when a reader stops early, e.g. the longer file of a compare
+            if stage == "scan":
+                self.records_scanned += count
+                if progress:
+                    position = total if finished else progress[1].tell()
+                    self.bytes_read += position
+                    if self.show_progress:
+                        self.print_progress(progress[0], position, total, file_started, final=True)
+            elif stage == "parse":
+                self.records_parsed += count
+
+    def print_progress(self, path, position, total, file_started, final=False):
+        now = time.perf_counter()
+        if not final and now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        elapsed = now - file_started
+        rate = position / elapsed if elapsed > 0 else 0
+        eta = (total - position) / rate if rate else 0
+        percent = 100 * position / total if total else 100
+        sys.stderr.write(f"\r⏳ {os.path.basename(path)}: {percent:5.1f}% ({position / 1e6:.1f} of {total / 1e6:.1f} MB), "
+                         f"{rate / 1e6:.1f} MB/s, ETA {format_duration(eta)}   ")
+        if final:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+    def report(self):
+        """Returns the metrics of the run so far as a dict, ready for JSON."""
+        seconds = time.perf_counter() - self.started
+        records = max(self.records_scanned, self.records_parsed)
+        stage_seconds = self.stage_seconds()
+        stages = {name: round(stage_seconds.get(name, 0.0), 3) for name in STAGES}
+        stages["other"] = round(max(seconds - sum(stage_seconds.values()), 0.0), 3)
+        return {
+            "command": sys.argv[1:],
+            "seconds": round(seconds, 3),
+            "bytes_read": self.bytes_read,
+            "records": records,
+            "malformed_records": self.malformed,
+            "mb_per_s": round(self.bytes_read / 1e6 / seconds, 2) if seconds else 0,
+            "rows_per_s": round(records / seconds) if seconds else 0,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": stages,
+        }
+
+    def finish(self, json_path=None, print_stages=True):
+        """Prints the stage table and the profile of the profiled stage, and writes the JSON record."""
+        self.stopped.set()
+        self.sampler.join()
+        report = self.report()
+        if print_stages:
+            peak = f", peak RSS {report['peak_rss_mb']} MB" if report["peak_rss_mb"] is not None else ""
+            print(f"📈 {report['seconds']}s, {report['bytes_read'] / 1e6:.1f} MB read, {report['records']} records "
+                  f"({report['malformed_records']} malformed), {report['mb_per_s']} MB/s, {report['rows_per_s']} rows/s{peak}")
+            for name, seconds in report["stages"].items():
+                share = 100 * seconds / report["seconds"] if report["seconds"] else 0
+                print(f"   {name:<16} {seconds:>9.3f}s {share:>6.1f}%")
+        if self.profiler is not None:
+            print(f"🔬 Profile of stage '{self.profile_stage}':")
+            pstats.Stats(self.profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(20)
+        if isinstance(json_path, str):
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"📈 Run metrics written to {json_path}")
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished workers in MB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # Bytes on macOS, KB elsewhere
+
+
+def active_metrics():
+    """The RunMetrics of this run, or None when instrumentation is off or in a worker process."""
+    metrics = METRICS
+    if metrics is None or metrics.pid != os.getpid():
+        return None
+    return metrics
+
+
+def instrument(records, stage, progress=None):
+    """Times an iterator as a stage (see RunMetrics.timed_records) when instrumentation is on."""
+    metrics = active_metrics()
+    return records if metrics is None else metrics.timed_records(records, stage, progress)
+
+
+def timed_stage(name):
+    """A context manager timing its block as a stage when instrumentation is on."""
+    metrics = active_metrics()
+    return nullcontext() if metrics is None else metrics.stage(name)
+
+
+# === Pipelined I/O ===
+PIPELINE = False  # Set by --pipeline: read, parse and write in separate threads
+PIPELINE_DEPTH = 4  # Blocks or batches queued between two pipeline stages
+PIPELINE_BATCH = 1000  # Records handed from the parser thread to the main thread at a time
+
+
+class PipelineStage:
+    """
+    Runs produce(put) in a background thread that feeds a bounded queue, for
+    get() to take from in order. A full queue makes the producer wait (backpressure).
+    An exception in the producer is raised again by get(), and close() makes put()
+    return False so that a producer stops early once its consumer is gone.
+    """
+    DONE = object()
+
+    def __init__(self, produce, name, depth=PIPELINE_DEPTH):
+        self.queue = queue.Queue(depth)
+        self.stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(produce,), name=name, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-# === Character Reader Class ===
-class CharReader:
-    def __init__(self, file):
+    def run(self, produce):
+        try:
+            produce(self.put)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.put(self.DONE)
+
+    def get(self):
+        """Returns the next item, or DONE after the last one."""
+        item = self.queue.get()
+        if item is self.DONE and self.error is not None:
+            raise self.error
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ReadAheadFile:
+    """
+    A file read sequentially from start by a background thread, one block ahead of
+    the caller, so the disk or network share is busy while the previous block is
+    worked on. With an encoding, blocks are also decoded there, with line breaks
+    translated as text mode does, and read() returns text.
+    read(n) returns at most n bytes or characters, and an empty value at the end.
+    tell() is the byte position in the file after the block being read.
+    """
+    def __init__(self, file_path, start=0, encoding=None, block_size=READ_BLOCK_SIZE):
+        self.file_path = file_path
+        self.empty = "" if encoding else b""
+        self.data = self.empty
+        self.offset = 0  # Position in data
+        self.position = start
+        self.eof = False
+
+        def produce(put):
+            decoder = None
+            if encoding:
+                decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+            with open(file_path, 'rb') as f:
+                f.seek(start)
+                while True:
+                    block = f.read(block_size)
+                    data = decoder.decode(block, final=not block) if decoder else block
+                    if (data or not block) and not put((data, f.tell())):
+                        return
+                    if not block:
+                        return
+
+        self.stage = PipelineStage(produce, "read")
+
+    def read(self, size=-1):
+        while self.offset >= len(self.data) and not self.eof:
+            item = self.stage.get()
+            if item is PipelineStage.DONE:
+                self.eof = True
+            else:
+                (self.data, self.position), self.offset = item, 0
+        buf, offset = self.data, self.offset
+        if size < 0 or len(buf) - offset <= size:
+            self.data, self.offset = self.empty, 0
+            return buf[offset:]
+        self.offset = offset + size
+        return buf[offset:offset + size]
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.stage.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WriteBehindFile:
+    """
+    Wraps a binary output file so that chunks are encoded and written by a background
+    thread while the caller formats the next batch. Text chunks are encoded with
+    encoder (the writer's incremental encoder), bytes are written as they are.
+    writelines() only waits when PIPELINE_DEPTH batches are queued. flush() waits
+    until everything handed over is written; a write error is raised by the next call.
+    """
+    def __init__(self, file, encoder, depth=PIPELINE_DEPTH):
         self.file = file
-        self.lookahead = []
+        self.encoder = encoder
+        self.queue = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="write", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        encode = self.encoder.encode
+        while True:
+            chunks = self.queue.get()
+            try:
+                if chunks is None:
+                    return
+                if self.error is None:
+                    self.file.writelines([encode(chunk) if type(chunk) is str else chunk for chunk in chunks])
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def writelines(self, chunks):
+        self.check()
+        self.queue.put(list(chunks))
+
+    def flush(self):
+        self.queue.join()
+        self.check()
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        self.queue.join()
+        return self.file.tell()
+
+    def close(self):
+        try:
+            self.queue.join()
+            self.queue.put(None)
+            self.thread.join()
+        finally:
+            self.file.close()
+        self.check()
 
-    def read(self):
-        """Reads the next character from the file."""
-        if self.lookahead:
-            return self.lookahead.pop(0)
-        return self.file.read(1)
 
-    def peek(self):
-        """Peeks at the next character without consuming it."""
-        while len(self.lookahead) < 1:
-            next_char = self.file.read(1)
-            if not next_char:  # EOF
-                return None
-            self.lookahead.append(next_char)
-        return self.lookahead[0]
-
-    def peek_two(self):
-        """Peeks at the next two characters without consuming them."""
-        while len(self.lookahead) < 2:
-            next_char = self.file.read(1)
-            if not next_char:  # EOF
-                break
-            self.lookahead.append(next_char)
-        if len(self.lookahead) >= 2:
-            return (self.lookahead[0], self.lookahead[1])
-        elif len(self.lookahead) == 1:
-            return (self.lookahead[0], None)
-        else:
-            return (None, None)
+def pipelined(records, batch_size=PIPELINE_BATCH):
+    """
+    Yields the items of records in order while a background thread produces them,
+    up to PIPELINE_DEPTH batches ahead of the caller.
+    """
+    def produce(put):
+        items = iter(records)
+        try:
+            while True:
+                batch = list(itertools.islice(items, batch_size))
+                if not batch or not put(batch):
+                    return
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+
+    stage = PipelineStage(produce, "parse")
+    try:
+        while True:
+            batch = stage.get()
+            if batch is PipelineStage.DONE:
+                return
+            yield from batch
+    finally:
+        stage.close()
+
 
 # === Helper Functions ===
 
@@ -79,27 +655,44 @@ def detect_and_open(file_path, mode='r'):
 
 def read_headers_and_rows(file_path):
     with detect_and_open(file_path) as f:
-        reader = CharReader(f)
-        header_line = next(read_dat_file_smart(file_path, encoding=detect_encoding(file_path, "")))
+        encoding = f.encoding
+        header_line = next(read_dat_file_smart(file_path, encoding=encoding))
         headers = [strip_one_quote(h) for h in header_line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
         rows = []
-        for line in read_dat_file_smart(file_path, encoding=detect_encoding(file_path, "")):
+        for line in read_dat_file_smart(file_path, encoding=encoding):
             parsed = parse_line(line, headers)
             if parsed:
-                rows.append(parsed)
+                rows.append(parsed)  # Value tuples in header order
         return headers, rows
 
 
-def export_data(headers, rows, output_path, fmt="dat", encoding=EXPORT_ENCODING):
-    
+def export_data(headers, rows, output_path, fmt="dat", encoding=EXPORT_ENCODING, stats=None, checkpoint=None):
+    """
+    Writes rows (any iterable, consumed once) to output_path in the chosen format.
+    CSV and TSV values are checked against Excel's cell limit while writing.
+    stats is an optional ColumnProfiler that sees every written row.
+    checkpoint is an optional Checkpoint that is saved and resumed with the output.
+    Returns the number of rows written.
+    """
     if fmt == "csv":
-        excel_warning(headers, rows) # Excel warning for CSV
-        export_to_csv(headers, rows, output_path, encoding=encoding)
+        return export_to_csv(headers, rows, output_path, encoding=encoding, stats=stats, checkpoint=checkpoint)
     elif fmt == "tsv":
-        excel_warning(headers, rows) # Excel warning for TSV
-        export_to_tsv(headers, rows, output_path, encoding=encoding)
+        return export_to_tsv(headers, rows, output_path, encoding=encoding, stats=stats, checkpoint=checkpoint)
     else:
-        export_to_dat(headers, rows, output_path, encoding=encoding)
+        return export_to_dat(headers, rows, output_path, encoding=encoding, stats=stats, checkpoint=checkpoint)
+
+
+def bomless_encoding(encoding):
+    """
+    Returns the codec to use for text appended after the start of a file, so that
+    encodings which write a BOM do not write a second one in the middle.
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8-sig':
+        return 'utf-8'
+    if name in ('utf-16', 'utf-32'):
+        return name + ('-le' if sys.byteorder == 'little' else '-be')
+    return encoding
 
 
 def get_mapping_dict(mapping_file):
@@ -109,200 +702,1753 @@ def get_mapping_dict(mapping_file):
 
 
 # === Encoding Detection ===
-def detect_encoding(file_path, fname):
-    """
-
-    Detects the file encoding by reading a larger sample (4KB) and applying several heuristics.
+ENCODING_SCAN_BLOCK = 16 * 1024 * 1024
+WINDOWS_1252_BYTE = re.compile(b'[\x80-\x9f]')  # Printable in Windows-1252, control characters in Latin-1
+ENCODING_SAMPLE_BYTES = None  # Scan the whole file unless --encoding-sample is given
+encoding_cache = {}  # (path, size, mtime, sample) -> (encoding, confidence, description)
 
-    Returns the detected encoding as a string or 'Error' if detection fails.
 
+def sniff_encoding(file_path, sample=None):
+    """
+    Detects the file encoding from BOM signatures and a 4KB UTF-8 check, then scans the
+    rest of the file (or only `sample` bytes of it) for a byte that only Windows-1252 prints.
+    Returns (encoding, confidence, description).
     """
+    with open(file_path, 'rb') as file:
+        raw = file.read(4096)  # Read first 4KB for better analysis
+
+        # Check for BOM signatures first.
+        if raw.startswith(b'\xEF\xBB\xBF'):
+            return 'utf-8-sig', 1.0, "UTF-8 BOM"
+        elif raw.startswith(b'\xFF\xFE'):
+            return 'utf-16', 1.0, "UTF-16 LE BOM"
+        elif raw.startswith(b'\xFE\xFF'):
+            return 'utf-16', 1.0, "UTF-16 BE BOM"
+
+        # Try to decode as UTF-8 (heuristic: if no error, assume UTF-8).
+        try:
+            raw.decode('utf-8')
+            # Multi-byte sequences that decode are good evidence; plain ASCII is not.
+            confidence = 0.9 if max(raw, default=0) >= 0x80 else 0.6
+            return 'utf-8', confidence, "UTF-8 (heuristic: decodes without error)"
+        except UnicodeDecodeError:
+            pass
+
+        # Fallback to latin-1, unless a Windows-1252 only byte shows up further on
+        remaining = sample
+        while remaining is None or remaining > 0:
+            size = ENCODING_SCAN_BLOCK if remaining is None else min(remaining, ENCODING_SCAN_BLOCK)
+            chunk = file.read(size)
+            if not chunk:
+                # No definitive Windows-1252 charater found
+                return 'LATIN-1', 0.8, "LATIN-1"
+            if WINDOWS_1252_BYTE.search(chunk):
+                return 'Windows-1252', 0.95, "Windows-1252"
+            if remaining is not None:
+                remaining -= len(chunk)
+        return 'LATIN-1', 0.5, "LATIN-1 (sampled)"
 
+
+def detect_encoding_info(file_path, fname, sample=None):
+    """
+    Returns (encoding, confidence) for a file, where confidence is between 0 and 1.
+    Results are cached by path, size and modification time, so a file is only
+    sniffed (and reported) once per run.
+    """
     try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        return 'No File', 0.0
+    if sample is None:
+        sample = ENCODING_SAMPLE_BYTES
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, sample)
+    result = encoding_cache.get(cache_key)
+    if result is None and CACHE:
+        header = valid_cache_header(file_path)
+        if header is not None and header["detected"] and header["detected"][0] == sample:
+            result = tuple(header["detected"][1:])  # Detected when the cache was built
+            encoding_cache[cache_key] = result
+            print(f"{fname} is detected as {result[2]} (cached)")
+    if result is None:
+        try:
+            with timed_stage("detect encoding"):
+                result = sniff_encoding(file_path, sample)
+        except FileNotFoundError:
+            print(f"File not found: {file_path}")
+            return 'No File', 0.0
+        except OSError:
+            print(f"{fname}: Unable to determine encoding using heuristics.")
+            return 'Error', 0.0
+        encoding_cache[cache_key] = result
+        print(f"{fname} is detected as {result[2]}")
+    return result[0], result[1]
+
+
+def detect_encoding(file_path, fname, sample=None):
+    """
+    Detects the file encoding (see sniff_encoding).
+    Returns the detected encoding as a string, 'No File' or 'Error' if detection fails.
+    """
+    return detect_encoding_info(file_path, fname, sample)[0]
 
-        with open(file_path, 'rb') as file:
+# === Line Reader & Parser ===
 
-            raw = file.read(4096)  # Read first 4KB for better analysis
+def read_dat_file_smart(file_path, encoding, offsets=None, start=0):
+    """
+    Reads a DAT file smartly, ignoring newlines that occur inside quoted fields.
+    Yields complete logical lines.
+    With start, reading begins that many characters into the decoded text, which must
+    be the start of a record. Record offsets (in characters) go to offsets when given.
+    """
+    with ReadAheadFile(file_path, encoding=encoding) if PIPELINE else open(file_path, 'r', encoding=encoding) as f:
+        skip = start
+        while skip > 0:
+            # Text files cannot seek to a character position, so decode up to it
+            block = f.read(min(skip, READ_BLOCK_SIZE))
+            if not block:
+                break
+            skip -= len(block)
+        yield from instrument(RecordScanner(f, offsets=offsets, base=start), "scan", (file_path, getattr(f, 'buffer', f)))
 
-            # Check for BOM signatures first.
+# === Strip only one leading and one trailing QUOTE_CHAR if present ===
+def strip_one_quote(s):
+    if s.startswith(QUOTE_CHAR):
+        s = s[1:]
+    if s.endswith(QUOTE_CHAR):
+        s = s[:-1]
+    return s
 
-            if raw.startswith(b'\xEF\xBB\xBF'):
+def is_canonical(line, sep, quote, field_count):
+    """
+    True if a record line (str or bytes) has one quote at each end and no quotes other
+    than those and the separators', so that only the first and last values need an
+    outer quote stripped.
+    """
+    return (line.count(quote) == 2 * field_count and line.startswith(quote) and line.endswith(quote)
+            and not line.startswith(sep) and not line.endswith(sep))
 
-                print(f"{fname} is detected as UTF-8 BOM")
 
-                return 'utf-8-sig'
+PROJECT_FIND_RATIO = 8  # One find() call costs about as much as splitting off this many fields
 
-            elif raw.startswith(b'\xFF\xFE'):
 
-                print(f"{fname} is detected as UTF-16 LE BOM")
+def project_values(line, sep, quote, field_count, columns):
+    """
+    Returns the unquoted values of only the given columns (ascending positions) of a
+    record line, str or bytes, or None if it does not have field_count fields.
+    When the columns sit early in the record, delimiters are located with find() and
+    the other values are never sliced out.
+    """
+    if line.count(sep) != field_count - 1:
+        return None
+    if not columns:
+        return []
+    qlen, slen = len(quote), len(sep)
+    if (columns[-1] + 1) * PROJECT_FIND_RATIO > field_count:
+        # Too many separators to step over one find() at a time, one split in C is cheaper
+        pieces = line.split(sep)
+        picked = [(c, pieces[c]) for c in columns]
+    else:
+        find = line.find
+        picked = []
+        pos = col = 0
+        for c in columns:
+            while col < c:
+                pos = find(sep, pos) + slen
+                col += 1
+            end = find(sep, pos)
+            picked.append((c, line[pos:end] if end >= 0 else line[pos:]))
+    canonical = is_canonical(line, sep, quote, field_count)
+    values = []
+    for c, value in picked:
+        if canonical:
+            if c == 0:
+                value = value[qlen:]
+            if c == field_count - 1:
+                value = value[:-qlen]
+        else:
+            # Strip only one leading and one trailing quote, as strip_one_quote does
+            if value.startswith(quote):
+                value = value[qlen:]
+            if value.endswith(quote):
+                value = value[:-qlen]
+        values.append(value)
+    return values
 
-                return 'utf-16'
 
-            elif raw.startswith(b'\xFE\xFF'):
+def split_values(line, field_count, report_mismatch=True, columns=None):
+    """
+    Splits a line from the DAT file into its unquoted field values, or only the values
+    of the given columns. Returns None, optionally reporting it, if the field count
+    does not match.
+    """
+    sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
+    if columns is not None:
+        values = project_values(line, sep, QUOTE_CHAR, field_count, columns)
+        if values is not None:
+            return tuple(values)
+        if report_mismatch:
+            print(f"Field count mismatch: expected {field_count}, got {line.count(sep) + 1} in row: {line}")
+        return None
+    values = line.split(sep)
+    if len(values) != field_count:
+        if report_mismatch:
+            print(f"Field count mismatch: expected {field_count}, got {len(values)} in row: {line}")
+        return None  # Field count mismatch, skip this row
+    return tuple([strip_one_quote(value) for value in values])
 
-                print(f"{fname} is detected as UTF-16 BE BOM")
 
-                return 'utf-16'
+def parse_line(line, headers):
+    """
+    Parses a line from the DAT file, splitting it into fields.
+    Returns a tuple of values in header order, or None if field count mismatch.
+    """
+    return split_values(line, len(headers))
 
-            # Try to decode as UTF-8 (heuristic: if no error, assume UTF-8).
 
-            try:
+def iter_record_values(file_path, encoding, jobs=1, report_mismatch=True, lazy=False, select=None, prefilter=None, checkpoint=None):
+    """
+    Reads the header record of a DAT file and returns its Schema with an iterator
+    over the value tuples of the remaining records (None for field count mismatches).
+    With jobs > 1 the records are parsed by a process pool over byte ranges.
+    With lazy set, records are LazyRecord objects where the encoding allows it.
+    With select (header names), only those columns are extracted from each record
+    and the returned Schema describes just them.
+    With prefilter (strings from where_literals), well-formed records that lack one of
+    the strings are skipped before they are split (not with jobs > 1).
+    With checkpoint (jobs must be 1), the position of the last record read is tracked
+    for it, and reading continues after that record if the checkpoint was loaded.
+    With --pipeline (and no checkpoint), records are scanned and parsed in a thread.
+    With --cache, records come from the column cache of the file, which is built
+    first if it is missing or out of date.
+    """
+    ahead = pipelined if PIPELINE and checkpoint is None else iter
+    if CACHE:
+        resuming = checkpoint is not None and checkpoint.state is not None
+        if not resuming or checkpoint.state["offset_unit"] == "row":
+            cache = load_column_cache(file_path, encoding)
+            if cache is None and not resuming:
+                cache = build_column_cache(file_path, encoding)
+            if cache is not None:
+                schema, columns = cache.schema, range(len(cache.schema))
+                if select is not None:
+                    schema, columns = schema.select(select)
+                return schema, ahead(instrument(cache.records(columns, report_mismatch, checkpoint), "parse"))
+    if lazy and jobs <= 1:
+        parsed = iter_lazy_records(file_path, encoding, report_mismatch, select, prefilter, checkpoint)
+        if parsed is not None:
+            return parsed[0], ahead(instrument(parsed[1], "parse"))
+    offsets = resume_at = None
+    if checkpoint is not None:
+        offsets, resume_at = checkpoint.track("char")
+    records = read_dat_file_smart(file_path, encoding, offsets)
+    header_line = next(records, None)
+    if header_line is None:
+        return Schema([]), iter(())
+    if resume_at is not None:
+        records.close()
+        records = read_dat_file_smart(file_path, encoding, offsets, resume_at)
+        next(records, None)  # Already written before the checkpoint
+    schema = Schema(strip_one_quote(h) for h in header_line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR))
+    field_count = len(schema)
+    columns = None
+    if select is not None:
+        schema, columns = schema.select(select)  # Resolved once, from the header
+    if jobs > 1:
+        ranges = split_body_ranges(file_path, encoding, jobs)
+        if ranges:
+            records.close()
+            return schema, instrument(iter_parallel_values(file_path, ranges, field_count, jobs, report_mismatch, columns), "parse")
+        print("ℹ️ Input is too small or irregular to split, parsing sequentially.")
+    rejects = make_prefilter(prefilter, QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR, field_count)
+    if rejects is not None:
+        records = (line for line in records if not rejects(line))
+    return schema, ahead(instrument((split_values(line, field_count, report_mismatch, columns) for line in records), "parse"))
+
+
+# === Schema ===
+class Schema:
+    """
+    Header names of a DAT file and their positions, shared by all of its rows.
+    Rows themselves are plain tuples (or LazyRecords) in header order.
+    """
+    __slots__ = ('headers', 'index')
 
-                raw.decode('utf-8')
+    def __init__(self, headers):
+        self.headers = list(headers)
+        self.index = {h: i for i, h in enumerate(self.headers)}  # Last one wins for repeated names
 
-                print(f"{fname} is detected as UTF-8 (heuristic: decodes without error)")
+    def __len__(self):
+        return len(self.headers)
 
-                return 'utf-8'
+    def rename(self, header_map):
+        """Returns the schema with headers replaced through header_map. Rows need no change."""
+        return Schema([header_map.get(h, h) for h in self.headers])
 
-            except UnicodeDecodeError:
+    def select(self, names):
+        """Returns the schema of the columns named in names, with their positions."""
+        columns = [i for i, h in enumerate(self.headers) if h in names]
+        return Schema([self.headers[i] for i in columns]), columns
 
-                pass
 
-            # Fallback to latin-1
+class LazyRecord:
+    """
+    A parsed record that keeps its field values as raw bytes and decodes a field only
+    when it is read. Indexing and iteration act like a tuple of values. RowWriter
+    copies the raw bytes straight into DAT output that uses the same encoding.
+    """
+    __slots__ = ('fields', 'codec')
 
-            try:
+    def __init__(self, fields, codec):
+        self.fields = fields  # Unquoted field values, still encoded
+        self.codec = codec
 
-                data = file.read()
+    def __len__(self):
+        return len(self.fields)
 
-                for b in data:
+    def __getitem__(self, i):
+        return decode_field(self.fields[i], self.codec)
 
-                    if 0x80 <= b <= 0x9F:
+    def __iter__(self):
+        codec = self.codec
+        return (decode_field(field, codec) for field in self.fields)
 
-                        #decode with Windows-1252 and Latin-1
+    def values(self):
+        codec = self.codec
+        return tuple([decode_field(field, codec) for field in self.fields])
 
-                        char_win = bytes([b]).decode('windows-1252',errors='replace')
 
-                        char_latin = bytes([b]).decode('latin-1',errors='replace')
+def read_dat_file_raw(file_path, codec, data_start, offsets=None):
+    """
+    Like read_dat_file_smart, but scans the undecoded bytes and yields records as bytes.
+    Line breaks inside values are left as they are; decode_field translates them.
+    The file offset of each record is appended to offsets when given.
+    """
+    if PIPELINE:
+        f = ReadAheadFile(file_path, data_start)
+    else:
+        f = open(file_path, 'rb')
+        f.seek(data_start)
+    with f:
+        yield from instrument(RecordScanner(f, codec=codec, offsets=offsets, base=data_start), "scan", (file_path, f))
 
-                        #Check category
 
-                        cat_win = category(char_win)
+def iter_lazy_records(file_path, encoding, report_mismatch=True, select=None, prefilter=None, checkpoint=None):
+    """
+    Bytes-level version of iter_record_values for encodings whose delimiters and line
+    breaks are plain bytes (UTF-8, Windows-1252, Latin-1). Returns the Schema and an
+    iterator of LazyRecord objects (None for field count mismatches), or None for
+    other encodings. select, prefilter and checkpoint work as in iter_record_values.
+    """
+    codec, data_start, unit = raw_layout(file_path, encoding)
+    if unit != 1:
+        return None
+    quote = QUOTE_CHAR.encode(codec)
+    sep = (QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR).encode(codec)
+    qlen = len(quote)
+    resume_at = None
+    offsets = array('Q') if BUILD_INDEX and (checkpoint is None or checkpoint.state is None) else None
+    if checkpoint is not None:
+        offsets, resume_at = checkpoint.track("byte", offsets)
+    records = read_dat_file_raw(file_path, codec, data_start, offsets)
+    header_line = next(records, None)
+    if header_line is None:
+        return None
+    if resume_at is not None:
+        records.close()
+        records = read_dat_file_raw(file_path, codec, resume_at, offsets)
+        next(records, None)  # Already written before the checkpoint
+    schema = Schema(strip_one_quote(h) for h in decode_field(header_line, codec).split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR))
+    field_count = len(schema)
+    headers = schema.headers
+    rejects = None
+    if prefilter:
+        try:
+            rejects = make_prefilter([literal.encode(codec) for literal in prefilter], sep, field_count)
+        except UnicodeEncodeError:
+            pass  # Not representable in this encoding; leave it to the predicate
+
+    def write_index():
+        # Only reached once the whole file has been scanned
+        if type(offsets) is array:
+            write_dat_index(file_path, encoding, headers, offsets)
+
+    if select is not None:
+        schema, columns = schema.select(select)  # Resolved once, from the header
+
+        def projected():
+            for line in records:
+                if rejects is not None and rejects(line):
+                    continue
+                fields = project_values(line, sep, quote, field_count, columns)
+                if fields is None and report_mismatch:
+                    print(f"Field count mismatch: expected {field_count}, got {line.count(sep) + 1} in row: {decode_field(line, codec, 'replace')}")
+                yield None if fields is None else LazyRecord(fields, codec)
+            write_index()
+
+        return schema, projected()
+
+    def parsed():
+        for line in records:
+            if rejects is not None and rejects(line):
+                continue
+            fields = line.split(sep)
+            if len(fields) != field_count:
+                if report_mismatch:
+                    print(f"Field count mismatch: expected {field_count}, got {len(fields)} in row: {decode_field(line, codec, 'replace')}")
+                yield None
+                continue
+            if is_canonical(line, sep, quote, field_count):
+                # Only the outer two quotes are left to strip
+                fields[0] = fields[0][qlen:]
+                fields[-1] = fields[-1][:-qlen]
+                yield LazyRecord(fields, codec)
+                continue
+            # Strip only one leading and one trailing quote, as strip_one_quote does
+            for i, field in enumerate(fields):
+                if field.startswith(quote):
+                    field = field[qlen:]
+                if field.endswith(quote):
+                    field = field[:-qlen]
+                fields[i] = field
+            yield LazyRecord(fields, codec)
+        write_index()
+
+    return schema, parsed()
+
+
+# === Record Index ===
+INDEX_SUFFIX = ".datidx"
+INDEX_VERSION = 1
+BUILD_INDEX = False  # Set by --index: full byte-level scans also write the sidecar index
+
+
+def write_dat_index(file_path, encoding, headers, offsets):
+    """
+    Writes the .datidx sidecar of a DAT file: one JSON line describing the file, then
+    the byte offset of every record (header record first) and of the end of the file
+    as little-endian 64-bit integers. Returns the index path, or None on failure.
+    """
+    stat = os.stat(file_path)
+    meta = {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "encoding": encoding,
+        "headers": headers,
+        "header_hash": hashlib.sha256("||".join(headers).encode()).hexdigest(),
+        "records": len(offsets),
+    }
+    table = array('Q', offsets)
+    table.append(stat.st_size)
+    if sys.byteorder != 'little':
+        table.byteswap()
+    index_path = file_path + INDEX_SUFFIX
+    try:
+        with open(index_path + ".part", 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            f.write(table.tobytes())
+        os.replace(index_path + ".part", index_path)
+    except OSError as e:
+        print(f"⚠️ Could not write index {index_path}: {e}")
+        return None
+    return index_path
 
-                        cat_latin = category(char_latin)
 
-                        #Printable in Windows-1252 but Control Number in Latin-1
+class DatIndex:
+    """
+    A .datidx sidecar that matches its DAT file. Record offsets are read from an mmap
+    of the index and records from an mmap of the DAT file, so any record can be
+    reached without scanning.
+    """
+    def __init__(self, file_path, meta, index_map, table_start):
+        self.file_path = file_path
+        self.meta = meta
+        self.headers = meta["headers"]
+        self.encoding = meta["encoding"]
+        self.records = meta["records"]  # Including the header record
+        self.index_map = index_map
+        self.table_start = table_start
+        self.data_map = None
+
+    @property
+    def row_count(self):
+        return max(self.records - 1, 0)
+
+    def offset(self, n):
+        return struct.unpack_from('<Q', self.index_map, self.table_start + 8 * n)[0]
+
+    def record(self, n):
+        """Returns the raw bytes of record n, where record 0 is the header record."""
+        if self.data_map is None:
+            with open(self.file_path, 'rb') as f:
+                self.data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.data_map[self.offset(n):self.offset(n + 1)].strip(b'\r\n')
+
+    def row_values(self, row):
+        """
+        Returns the values of a row numbered as in diff reports (row 2 is the first
+        record after the header), or None if that record has the wrong field count.
+        """
+        codec = raw_layout(self.file_path, self.encoding)[0]
+        quote = QUOTE_CHAR.encode(codec)
+        sep = (QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR).encode(codec)
+        field_count = len(self.headers)
+        fields = project_values(self.record(row - 1), sep, quote, field_count, range(field_count))
+        return None if fields is None else [decode_field(field, codec) for field in fields]
+
+    def close(self):
+        self.index_map.close()
+        if self.data_map is not None:
+            self.data_map.close()
+
+
+def load_dat_index(file_path):
+    """Returns the DatIndex of a DAT file, or None if it has none or it is out of date."""
+    try:
+        stat = os.stat(file_path)
+        with open(file_path + INDEX_SUFFIX, 'rb') as f:
+            index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    table_start = index_map.find(b'\n') + 1
+    try:
+        meta = json.loads(index_map[:table_start])
+        valid = (meta["version"] == INDEX_VERSION and meta["size"] == stat.st_size
+                 and meta["mtime_ns"] == stat.st_mtime_ns
+                 and len(index_map) == table_start + 8 * (meta["records"] + 1))
+    except (ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        index_map.close()
+        return None
+    return DatIndex(file_path, meta, index_map, table_start)
+
+
+def build_dat_index(file_path, encoding):
+    """
+    Scans a DAT file for its record offsets, without parsing the records, and writes
+    its .datidx sidecar. Returns the loaded DatIndex, or None for encodings the
+    byte-level scanner does not handle (UTF-16).
+    """
+    codec, data_start, unit = raw_layout(file_path, encoding)
+    if unit != 1:
+        return None
+    offsets = array('Q')
+    records = read_dat_file_raw(file_path, codec, data_start, offsets)
+    header_line = next(records, None)
+    if header_line is None:
+        return None
+    headers = [strip_one_quote(h) for h in decode_field(header_line, codec).split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
+    for _ in records:
+        pass
+    if write_dat_index(file_path, encoding, headers, offsets) is None:
+        return None
+    return load_dat_index(file_path)
+
+
+def open_dat_index(file_path):
+    """
+    Returns (DatIndex or None, encoding, status) for a DAT file, building the index
+    when it is missing or out of date. encoding is 'Error'/'No File' if detection failed.
+    """
+    index = load_dat_index(file_path)
+    if index is not None:
+        return index, index.encoding, "up to date"
+    encoding = detect_encoding(file_path, os.path.basename(file_path))
+    if encoding in ('Error', 'No File'):
+        return None, encoding, ""
+    index = build_dat_index(file_path, encoding)
+    if index is None:
+        return None, encoding, "not available for this encoding"
+    return index, encoding, f"built {os.path.basename(file_path) + INDEX_SUFFIX}"
 
-                        if not cat_win.startswith('C') and cat_latin.startswith('C'):
 
-                            print(f"{fname} is detected as Windows-1252")
+def inspect_dat(file_path):
+    """Prints the encoding, row count and headers of a DAT file, from its index when it has one."""
+    index, encoding, status = open_dat_index(file_path)
+    if encoding in ('Error', 'No File'):
+        return
+    if index is not None:
+        headers, rows = index.headers, index.row_count
+        index.close()
+    else:
+        schema, records = iter_record_values(file_path, encoding, report_mismatch=False)
+        headers, rows = schema.headers, sum(1 for _ in records)
+    print(f"🔎 {os.path.basename(file_path)}")
+    print(f"   Encoding: {encoding}")
+    print(f"   Rows:     {rows}")
+    print(f"   Fields:   {len(headers)}")
+    print(f"   Headers:  {', '.join(headers)}")
+    print(f"   Index:    {status}")
+
+
+def print_dat_row(file_path, row):
+    """Prints one row, numbered as in diff reports, reading it through the index."""
+    index, encoding, _ = open_dat_index(file_path)
+    if encoding in ('Error', 'No File'):
+        return
+    if index is not None:
+        headers, last_row = index.headers, index.row_count + 1
+        values = index.row_values(row) if 2 <= row <= last_row else None
+        index.close()
+    else:
+        schema, records = iter_record_values(file_path, encoding, report_mismatch=False)
+        headers = schema.headers
+        values = next(itertools.islice(records, row - 2, None), None) if row >= 2 else None
+    if values is None:
+        print(f"❌ Row {row} is not a valid record of {os.path.basename(file_path)}.")
+        return
+    print(f"📄 Row {row} of {os.path.basename(file_path)}:")
+    for h, value in zip(headers, values):
+        print(f"   {h}: {value}")
+
+
+# === Column Cache ===
+# A .datcol file holds the parsed values of a DAT file column by column:
+#   magic | footer offset (u64) | header length (u32) | header JSON | column chunks | footer JSON
+# The header describes the source (size, mtime, sample hash, encoding) and its headers.
+# Rows are stored in chunks; each column of a chunk is
+#   byte length (u32) | value count (u32) | separator code point (u32) | UTF-8 values joined by the separator
+# where the separator is a character that does not occur in that chunk. The footer lists
+# the chunks ([records, rows, [[offset, length] per column]]) and the malformed records.
+CACHE_MAGIC = b"DATCOL\x00\x01"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".datcol"
+CACHE = False  # Set by --cache: read DAT files through the column cache, building it on first use
+CACHE_DIR = os.environ.get("DAT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".datcache")
+CACHE_SIZE_MB = 10240  # Size the cache is pruned to after a build (and by --prune-cache without a size)
+CACHE_CHUNK_ROWS = 65536  # Rows per chunk
+CACHE_CHUNK_CHARS = 64 * 1024 * 1024  # Characters of record text per chunk, for wide rows
+CACHE_HASH_BYTES = 1024 * 1024  # Bytes hashed from each end of the source
+CACHE_SEPARATORS = [chr(c) for c in range(32) if chr(c) not in "\t\n\r"] + [chr(c) for c in range(0xE000, 0xF900)]
+valid_caches = {}  # (cache path, size, mtime) of sources checked in this run -> header
+
+
+def cache_path_of(file_path):
+    """Path of the cache file of a DAT file, named after the file and a hash of its full path."""
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8', 'surrogatepass')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(file_path)}.{digest}{CACHE_SUFFIX}")
+
+
+def source_hash(file_path, size):
+    """Hash of the size and the first and last CACHE_HASH_BYTES of a file."""
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        h.update(f.read(CACHE_HASH_BYTES))
+        if size > CACHE_HASH_BYTES:
+            f.seek(max(size - CACHE_HASH_BYTES, CACHE_HASH_BYTES))
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def read_cache_header(cache_path):
+    """Returns (header dict, offset of the first chunk, footer offset) of a cache file, or None."""
+    try:
+        with open(cache_path, 'rb') as f:
+            start = f.read(20)
+            if len(start) != 20 or start[:8] != CACHE_MAGIC:
+                return None
+            footer_offset, header_len = struct.unpack('<QI', start[8:])
+            header = json.loads(f.read(header_len))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("version") != CACHE_VERSION or not footer_offset:
+        return None
+    return header, 20 + header_len, footer_offset
 
-                            return 'Windows-1252'
 
-                # No definitive Windows-1252 charater found
+def valid_cache_header(file_path):
+    """
+    Returns the header of the cache file of a DAT file if it matches the file as it is
+    now (size, modification time and sample hash), otherwise None.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    cache_path = cache_path_of(file_path)
+    key = (cache_path, stat.st_size, stat.st_mtime_ns)
+    if key in valid_caches:
+        return valid_caches[key]
+    found = read_cache_header(cache_path)
+    header = None
+    if found is not None:
+        h = found[0]
+        if (h.get("size") == stat.st_size and h.get("mtime_ns") == stat.st_mtime_ns
+                and h.get("hash") == source_hash(file_path, stat.st_size)):
+            header = h
+    valid_caches[key] = header
+    return header
+
+
+class ColumnCache:
+    """
+    An up-to-date cache file of a DAT file, memory-mapped. Only the chunks of the
+    columns that are asked for are decoded.
+    """
+    def __init__(self, cache_path, header, footer, data_map):
+        self.cache_path = cache_path
+        self.header = header
+        self.schema = Schema(header["headers"])
+        self.chunks = footer["chunks"]
+        self.malformed = {record: message for record, message in footer["malformed"]}
+        self.data_map = data_map
+
+    def column_chunk(self, chunk, c):
+        offset, length = chunk[2][c]
+        size, count, sep = struct.unpack_from('<III', self.data_map, offset)
+        with memoryview(self.data_map) as view:
+            text = codecs.utf_8_decode(view[offset + 12:offset + length], 'surrogatepass', True)[0]
+        values = text.split(chr(sep))
+        if size + 4 != length or len(values) != count:
+            raise ValueError(f"Cache file {self.cache_path} is damaged")
+        return values
+
+    def records(self, columns, report_mismatch=True, checkpoint=None):
+        """
+        Yields the value tuples of the given columns (positions) of every record, or
+        None for malformed records (printing the parser's message with report_mismatch),
+        like iter_record_values. With a checkpoint, record numbers are tracked and
+        reading resumes after the checkpointed one.
+        """
+        tracker, resume_at = checkpoint.track("row") if checkpoint is not None else (None, None)
+        start = resume_at or 0  # Records up to this number were read already
+        malformed = self.malformed
+        record = 0  # Number of the last record yielded; 1 is the first after the header
+        try:
+            for chunk in self.chunks:
+                records, rows = chunk[0], chunk[1]
+                if record + records <= start:
+                    record += records
+                    continue
+                if not rows:
+                    values = iter(())
+                elif columns:
+                    values = zip(*[self.column_chunk(chunk, c) for c in columns])
+                else:
+                    values = itertools.repeat((), rows)
+                if tracker is None and record >= start and not any(record < r <= record + records for r in malformed):
+                    record += records
+                    yield from values
+                    continue
+                for _ in range(records):
+                    record += 1
+                    row = None
+                    if record in malformed:
+                        if record > start and report_mismatch:
+                            print(malformed[record])
+                    else:
+                        row = next(values)
+                    if record > start:
+                        if tracker is not None:
+                            tracker.append(record)
+                        yield row
+        finally:
+            self.close()
+
+    def close(self):
+        if self.data_map is not None:
+            self.data_map.close()
+            self.data_map = None
+
+
+def load_column_cache(file_path, encoding):
+    """Returns the ColumnCache of a DAT file read as encoding, or None if it has no up-to-date one."""
+    header = valid_cache_header(file_path)
+    if header is None or header["encoding"] != encoding:
+        return None
+    cache_path = cache_path_of(file_path)
+    found = read_cache_header(cache_path)
+    if found is None:
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            data_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = json.loads(data_map[found[2]:])
+    except (OSError, ValueError):
+        return None
+    os.utime(cache_path)  # Recently used, for pruning
+    return ColumnCache(cache_path, header, footer, data_map)
+
+
+def write_cache_chunk(f, rows):
+    """Appends one chunk of rows to a cache file and returns its [offset, length] per column."""
+    placed = []
+    n = len(rows)
+    for column in zip(*rows):
+        for sep in CACHE_SEPARATORS:
+            text = sep.join(column)
+            if text.count(sep) == n - 1:  # No value contains sep
+                break
+        else:
+            raise ValueError("no free separator character for a cache chunk")
+        data = text.encode('utf-8', 'surrogatepass')
+        offset = f.tell()
+        f.write(struct.pack('<III', len(data) + 8, n, ord(sep)))
+        f.write(data)
+        placed.append([offset, len(data) + 12])
+    return placed
 
-                print(f"{fname} is detected as LATIN-1")
 
-                return 'LATIN-1'
+def build_column_cache(file_path, encoding):
+    """
+    Parses a DAT file into its cache file and returns the loaded ColumnCache, or None
+    if the file cannot be cached (it changed while being read, does not decode, or the
+    cache cannot be written).
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    # How the encoding was detected, so later runs can skip detection
+    detected = next(([key[3], *result] for key, result in encoding_cache.items() if key[0] == os.path.abspath(file_path)
+                     and key[1:3] == (stat.st_size, stat.st_mtime_ns) and result[0] == encoding), None)
+    codec, data_start, unit = raw_layout(file_path, encoding)
+    if unit == 1:
+        lines = (decode_field(line, codec) for line in read_dat_file_raw(file_path, codec, data_start))
+    else:
+        lines = read_dat_file_smart(file_path, encoding)
+    sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
+    cache_path = cache_path_of(file_path)
+    part_path = f"{cache_path}.{os.getpid()}.part"  # Batch workers may cache the same file at once
+    print(f"🗃️ Building column cache for {os.path.basename(file_path)} ...")
+    try:
+        header_line = next(lines, None)
+        if header_line is None:
+            return None
+        headers = [strip_one_quote(h) for h in header_line.split(sep)]
+        field_count = len(headers)
+        header = {"version": CACHE_VERSION, "source": os.path.abspath(file_path), "size": stat.st_size,
+                  "mtime_ns": stat.st_mtime_ns, "hash": source_hash(file_path, stat.st_size),
+                  "encoding": encoding, "detected": detected, "headers": headers}
+        header_data = json.dumps(header).encode('utf-8')
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        chunks = []
+        malformed = []
+        with timed_stage("write"), open(part_path, 'wb') as f:
+            f.write(CACHE_MAGIC + struct.pack('<QI', 0, len(header_data)) + header_data)
+            rows, chars = [], 0
+            record = chunk_start = 0  # Record numbers, 1 being the first after the header
+            for line in lines:
+                record += 1
+                values = split_values(line, field_count, report_mismatch=False)
+                if values is None:
+                    malformed.append([record, f"Field count mismatch: expected {field_count}, got {line.count(sep) + 1} in row: {line}"])
+                    continue
+                rows.append(values)
+                chars += len(line)
+                if len(rows) >= CACHE_CHUNK_ROWS or chars >= CACHE_CHUNK_CHARS:
+                    chunks.append([record - chunk_start, len(rows), write_cache_chunk(f, rows)])
+                    rows, chars, chunk_start = [], 0, record
+            if record > chunk_start:
+                chunks.append([record - chunk_start, len(rows), write_cache_chunk(f, rows)])
+            footer_offset = f.tell()
+            f.write(json.dumps({"chunks": chunks, "malformed": malformed}).encode('utf-8'))
+            f.seek(8)
+            f.write(struct.pack('<Q', footer_offset))
+        after = os.stat(file_path)
+        if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            print(f"⚠️ {os.path.basename(file_path)} changed while it was being cached, cache discarded.")
+            os.remove(part_path)
+            return None
+        os.replace(part_path, cache_path)
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        print(f"⚠️ Could not cache {os.path.basename(file_path)}: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return None
+    finally:
+        lines.close()
+    valid_caches.pop((cache_path, stat.st_size, stat.st_mtime_ns), None)
+    prune_column_cache(CACHE_SIZE_MB, keep=cache_path, quiet=True)
+    return load_column_cache(file_path, encoding)
+
+
+def build_cache_command(file_path):
+    """--build-cache: builds the cache of a DAT file unless it is up to date, and reports it."""
+    encoding = detect_encoding(file_path, os.path.basename(file_path))
+    if encoding in ('Error', 'No File'):
+        return
+    cache = load_column_cache(file_path, encoding)
+    status = "up to date"
+    if cache is None:
+        started = time.perf_counter()
+        cache = build_column_cache(file_path, encoding)
+        status = f"built in {time.perf_counter() - started:.1f}s"
+    if cache is None:
+        return
+    rows = sum(chunk[1] for chunk in cache.chunks)
+    cache.close()
+    print(f"🗃️ {os.path.basename(file_path)}: {rows} rows, {len(cache.schema)} columns, "
+          f"{os.path.getsize(cache.cache_path) / 1e6:.1f} MB cache {status} ({cache.cache_path})")
 
-            except UnicodeDecodeError:
 
-                print(f"{fname}: Unable to determine encoding using heuristics.")
+def prune_column_cache(size_mb=CACHE_SIZE_MB, keep=None, quiet=False):
+    """
+    Deletes cache files whose DAT file is gone or has changed, then the least recently
+    used ones until the cache holds at most size_mb megabytes. keep is never deleted.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        if not quiet:
+            print(f"ℹ️ No cache at {CACHE_DIR}.")
+        return
+    entries = []  # (last used, size, path) of up-to-date cache files
+    removed, freed = 0, 0
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if not (name.endswith(CACHE_SUFFIX) or (CACHE_SUFFIX in name and name.endswith(".part"))) or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        found = read_cache_header(path) if name.endswith(CACHE_SUFFIX) else None
+        stale = found is None
+        if found is not None:
+            source = found[0].get("source", "")
+            try:
+                src = os.stat(source)
+                stale = (src.st_size, src.st_mtime_ns) != (found[0].get("size"), found[0].get("mtime_ns"))
+            except OSError:
+                stale = True
+        if name.endswith(".part") and time.time() - stat.st_mtime < 24 * 3600:
+            continue  # May still be being written
+        if stale and path != keep:
+            os.remove(path)
+            removed += 1
+            freed += stat.st_size
+        elif not stale:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    kept = len(entries)
+    for _, size, path in sorted(entries):
+        if total <= size_mb * 1024 * 1024:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        removed += 1
+        freed += size
+        total -= size
+        kept -= 1
+    if not quiet or removed:
+        print(f"🧹 Removed {removed} cache file(s) ({freed / 1e6:.1f} MB). {kept} file(s), {total / 1e6:.1f} MB left in {CACHE_DIR}")
+    return removed
 
-                return 'Error'
 
-    except FileNotFoundError:
+# === Parallel Parsing ===
+PARALLEL_CHUNK_SIZE = 32 * 1024 * 1024  # Bytes of input handed to a worker at a time
 
-        print(f"File not found: {file_path}")
 
-        return 'No File'
+def raw_layout(file_path, encoding):
+    """
+    Returns the byte-level codec, the offset of the first character after any BOM and
+    the code unit size for a file opened with a detected encoding.
+    """
+    name = codecs.lookup(encoding).name
+    if name == 'utf-8-sig':
+        return 'utf-8', 3, 1
+    if name == 'utf-16':
+        with open(file_path, 'rb') as f:
+            bom = f.read(2)
+        return ('utf-16-be' if bom == codecs.BOM_UTF16_BE else 'utf-16-le'), 2, 2
+    return name, 0, 1
 
-# === Line Reader & Parser ===
 
-def read_dat_file_smart(file_path, encoding):
+class BoundaryFinder:
     """
-    Reads a DAT file smartly, ignoring newlines that occur inside quoted fields.
-    Yields complete logical lines.
+    Finds true record boundaries in the raw bytes of a DAT file, i.e. the opening quote
+    that follows a closing quote and a line break outside a quoted field.
+    Mirrors RecordScanner: quote/separator/line-break/quote tokens are consumed left to
+    right, so a candidate only ends a record when it is an even number of tokens away
+    from the start of its chain of back-to-back tokens.
     """
-    with open(file_path, 'r', encoding=encoding) as f:
-        reader = CharReader(f)
-        buffer = ''
-        in_quote = False  # Track whether we are inside a quoted field
+    WINDOW = 1024 * 1024
 
+    def __init__(self, file, codec, data_start, unit):
+        self.file = file
+        self.data_start = data_start
+        self.unit = unit
+        enc = lambda s: s.encode(codec)
+        self.quote = enc(QUOTE_CHAR)
+        self.links = [enc(FIELD_SEP), enc('\r\n'), enc('\n'), enc('\r')]
+        self.newline_token = re.compile(re.escape(self.quote) + b'(?:' + b'|'.join(re.escape(l) for l in self.links[1:]) + b')' + re.escape(self.quote))
+
+    def chain_position(self, buf, t, lo):
+        """
+        Number of tokens between the token at t and the start of its chain, or None when
+        the chain runs off the start of the window. lo > 0 means the window holds the
+        file's first opening quote just before lo, which never closes a field.
+        """
+        steps = 0
+        q = len(self.quote)
         while True:
-            char = reader.read()
-            peeked = reader.peek_two()
-            next_chars = "".join(c if c is not None else "" for c in peeked)
-            if not char:
-                if buffer:
-                    yield buffer.strip('\r\n')
-                break
-
-            if char == QUOTE_CHAR and not in_quote:
-                in_quote = True
-                buffer += char
-            elif char == QUOTE_CHAR and in_quote and (next_chars == FIELD_SEP + QUOTE_CHAR or next_chars == '\n' + QUOTE_CHAR):
-                in_quote = False
-                buffer += char
-            elif (char == '\n' or char == '\r') and not in_quote and next_chars != FIELD_SEP + QUOTE_CHAR:
-                yield buffer.strip('\r\n')
-                buffer = ''
+            for link in self.links:
+                if buf.endswith(link, 0, t):
+                    prev = t - len(link) - q
+                    break
             else:
-                buffer += char
+                return None if t == 0 and lo == 0 else steps
+            if prev < lo:
+                return steps if lo > 0 else None
+            if buf[prev:prev + q] != self.quote:
+                return steps
+            steps += 1
+            t = prev
+
+    def chain_position_at(self, t):
+        """Like chain_position for absolute offset t, reading further back until the chain start is known."""
+        lookback = 4096
+        while True:
+            start = max(self.data_start, t - lookback)
+            start += (start - self.data_start) % self.unit
+            self.file.seek(start)
+            buf = self.file.read(t - start)
+            lo = self.data_start - start + 1 if start <= self.data_start else 0
+            steps = self.chain_position(buf, t - start, lo)
+            if steps is not None:
+                return steps
+            lookback *= 4
+
+    def next_boundary(self, offset):
+        """Returns the first record boundary at or after offset, or None at end of file."""
+        unit = self.unit
+        offset += (offset - self.data_start) % unit
+        while True:
+            self.file.seek(offset)
+            buf = self.file.read(self.WINDOW)
+            if not buf:
+                return None
+            # Positions at or before the file's first opening quote are not candidates
+            lo = self.data_start - offset + 1 if offset <= self.data_start else 0
+            pos = 0
+            while True:
+                m = self.newline_token.search(buf, pos)
+                if m is None:
+                    break
+                t = m.start()
+                if (offset + t - self.data_start) % unit == 0 and t >= lo:
+                    steps = self.chain_position(buf, t, lo)
+                    if steps is None:
+                        steps = self.chain_position_at(offset + t)
+                    if steps % 2 == 0:
+                        return offset + m.end() - len(self.quote)
+                pos = t + 1
+            if len(buf) < self.WINDOW:
+                return None
+            offset += self.WINDOW - 16  # Overlap so tokens across windows are not missed
 
-# === Strip only one leading and one trailing QUOTE_CHAR if present ===
-def strip_one_quote(s):
-    if s.startswith(QUOTE_CHAR):
-        s = s[1:]
-    if s.endswith(QUOTE_CHAR):
-        s = s[:-1]
-    return s
 
-def parse_line(line, headers):
+def split_body_ranges(file_path, encoding, jobs):
     """
-    Parses a line from the DAT file, splitting it into fields.
-    Returns a dict mapping headers to values, or None if field count mismatch.
+    Splits the records after the header into byte ranges that start on record boundaries.
+    Returns (codec, [(start, end), ...]) or None when the file cannot be split safely.
     """
-    values = line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)
-    values = [strip_one_quote(value) for value in values]
-    if len(values) != len(headers):
-        print(f"Field count mismatch: expected {len(headers)}, got {len(values)} in row: {line}")
-        return None  # Field count mismatch, skip this row
-    row = {header: value for header, value in zip(headers, values)}
-    return row
+    codec, data_start, unit = raw_layout(file_path, encoding)
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        finder = BoundaryFinder(f, codec, data_start, unit)
+        f.seek(data_start)
+        if f.read(len(finder.quote)) != finder.quote:
+            return None  # Leading text before the first record
+        body_start = finder.next_boundary(data_start)
+        if body_start is None:
+            return None
+        parts = max(jobs, -(-(size - body_start) // PARALLEL_CHUNK_SIZE))
+        if parts < 2:
+            return None
+        bounds = [body_start]
+        for k in range(1, parts):
+            target = body_start + (size - body_start) * k // parts
+            if target <= bounds[-1]:
+                continue
+            boundary = finder.next_boundary(target)
+            if boundary is None:
+                break
+            if boundary > bounds[-1]:
+                bounds.append(boundary)
+        bounds.append(size)
+    if len(bounds) < 3:
+        return None
+    return codec, list(zip(bounds, bounds[1:]))
 
-# === Excel Warnings ===
-def excel_warning(headers, rows, warn_limit=32767):
+
+def parse_range_task(task):
+    """Worker: decodes one byte range with universal newlines and splits its records."""
+    file_path, codec, start, end, field_count, report_mismatch, columns = task
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = data.decode(codec).replace('\r\n', '\n').replace('\r', '\n')
+    return [split_values(line, field_count, report_mismatch, columns) for line in RecordScanner(io.StringIO(text))]
+
+
+def iter_parallel_values(file_path, ranges, field_count, jobs, report_mismatch=True, columns=None):
     """
-    Warns if any field value exceeds Excel's 32,767 character cell limit.
+    Parses byte ranges in a process pool and yields their records' values in file order.
+    Only a few ranges are in flight at a time, so memory stays bounded.
     """
-    for row_idx, row in enumerate(rows, 2):
-        for h in headers:
-            val = str(row.get(h, ""))
-            if len(val) > warn_limit:
-                print(" ╔═══════════════════════════════════════════════════════════════════════════════════════════════════════════╗")
-                print(f" ║ Warning: Value in row {row_idx}, column '{h}' exceeds Excel's 32,767 char limit ({len(val)} chars)!    ║")
-                print(" ║ Excel may not display this cell correctly. Consider truncating or splitting.                              ║")
-                print(" ╚═══════════════════════════════════════════════════════════════════════════════════════════════════════════╝")
+    codec, spans = ranges
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = deque()
+        for start, end in spans:
+            pending.append(executor.submit(parse_range_task, (file_path, codec, start, end, field_count, report_mismatch, columns)))
+            if len(pending) >= jobs * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+# === Column Statistics ===
+EXCEL_CELL_LIMIT = 32767  # Longest value Excel shows in a cell
+HLL_PRECISION = 12  # 4096 registers per column, about 1.6% error on distinct counts
+OVER_LIMIT_ROWS = 5  # Row numbers kept per column for values over the Excel limit
+PROFILE_BATCH_ROWS = 10000  # Rows ColumnProfiler buffers before measuring them a column at a time
 
 
+def value_hash(value):
+    """64-bit hash of a value, the same in every process and run."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter that uses the same small, fixed amount of memory
+    however many values it sees.
+    """
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p=HLL_PRECISION):
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add_hashes(self, hashes):
+        registers = self.registers
+        shift = 64 - self.p
+        mask = (1 << shift) - 1
+        for h in hashes:
+            rank = shift - (h & mask).bit_length() + 1
+            i = h >> shift
+            if rank > registers[i]:
+                registers[i] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        registers = self.registers
+        m = len(registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # Linear counting is closer for small counts
+        return round(estimate)
+
+
+class ColumnProfiler:
+    """
+    Collects per-column statistics from rows as they are read or written: longest
+    and mean value length, empty values, values over Excel's cell limit (with their
+    first row numbers) and, with distinct set, an approximate distinct count.
+    Rows are buffered and measured a column at a time, so each row costs little more
+    than the append. Row numbers start at 2, the first row after the header.
+    """
+    def __init__(self, headers, distinct=True, batch_size=PROFILE_BATCH_ROWS):
+        n = len(headers)
+        self.headers = list(headers)
+        self.batch_size = batch_size
+        self.rows = 0
+        self.max_len = [0] * n
+        self.total_len = [0] * n
+        self.empty = [0] * n
+        self.over_limit = [0] * n
+        self.over_limit_rows = [[] for _ in range(n)]
+        self.sketches = [HyperLogLog() for _ in range(n)] if distinct else None
+        self.pending = []
+
+    def add(self, values):
+        if type(values) is LazyRecord:
+            values = values.values()
+        self.pending.append(values)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with timed_stage("column stats"):
+                self.measure(self.pending)
+            self.pending = []
+
+    def measure(self, rows):
+        first_row = self.rows + 2
+        for c, column in enumerate(zip(*rows)):
+            lengths = list(map(len, column))
+            longest = max(lengths)
+            if longest > self.max_len[c]:
+                self.max_len[c] = longest
+            self.total_len[c] += sum(lengths)
+            self.empty[c] += lengths.count(0)
+            if longest > EXCEL_CELL_LIMIT:
+                over = [first_row + i for i, n in enumerate(lengths) if n > EXCEL_CELL_LIMIT]
+                self.over_limit[c] += len(over)
+                kept = self.over_limit_rows[c]
+                kept.extend(over[:OVER_LIMIT_ROWS - len(kept)])
+            if self.sketches is not None:
+                self.sketches[c].add_hashes(map(value_hash, set(column)))  # Repeats hashed once per batch
+        self.rows += len(rows)
+
+    def merge(self, other):
+        """Adds the statistics of other, whose rows follow the rows seen so far."""
+        self.flush()
+        other.flush()
+        for c in range(len(self.headers)):
+            self.max_len[c] = max(self.max_len[c], other.max_len[c])
+            self.total_len[c] += other.total_len[c]
+            self.empty[c] += other.empty[c]
+            self.over_limit[c] += other.over_limit[c]
+            kept = self.over_limit_rows[c]
+            kept.extend(self.rows + row for row in other.over_limit_rows[c][:OVER_LIMIT_ROWS - len(kept)])
+            if self.sketches is not None and other.sketches is not None:
+                self.sketches[c].merge(other.sketches[c])
+        self.rows += other.rows
+
+    def report(self):
+        """Returns the statistics as a dict, ready for JSON."""
+        self.flush()
+        columns = []
+        for c, h in enumerate(self.headers):
+            columns.append({
+                "name": h,
+                "max_length": self.max_len[c],
+                "mean_length": round(self.total_len[c] / self.rows, 2) if self.rows else 0,
+                "empty": self.empty[c],
+                "distinct_estimate": self.sketches[c].count() if self.sketches is not None else None,
+                "over_excel_limit": self.over_limit[c],
+                "over_excel_limit_rows": self.over_limit_rows[c],
+            })
+        return {"rows": self.rows, "columns": columns}
+
+    def print_summary(self):
+        report = self.report()
+        width = max([len("Column")] + [len(h) for h in self.headers])
+        print(f"📊 Column statistics ({report['rows']} rows):")
+        print(f"   {'Column':<{width}}  {'Max len':>9}  {'Mean len':>9}  {'Empty':>9}  {'Distinct':>9}  {'Over Excel limit':>16}")
+        for col in report["columns"]:
+            distinct = "" if col["distinct_estimate"] is None else f"~{col['distinct_estimate']}"
+            print(f"   {col['name']:<{width}}  {col['max_length']:>9}  {col['mean_length']:>9}  {col['empty']:>9}  {distinct:>9}  {col['over_excel_limit']:>16}")
+
+    def print_excel_summary(self):
+        """Prints one warning listing the columns with values over Excel's cell limit, if any."""
+        self.flush()
+        total = sum(self.over_limit)
+        if not total:
+            return
+        print(f"⚠️ {total} value(s) exceed Excel's {EXCEL_CELL_LIMIT:,} character cell limit; Excel may not display them correctly:")
+        for c, h in enumerate(self.headers):
+            if self.over_limit[c]:
+                rows = ', '.join(map(str, self.over_limit_rows[c]))
+                more = ', ...' if self.over_limit[c] > len(self.over_limit_rows[c]) else ''
+                print(f"   {h}: {self.over_limit[c]} value(s), longest {self.max_len[c]} chars (row {rows}{more})")
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2, ensure_ascii=False)
+        print(f"📊 Column statistics written to {path}")
+
+
+def report_column_stats(profiler, json_path=None):
+    """Prints the statistics table of a profiler and writes the JSON report if a path is given."""
+    if profiler is None:
+        return
+    profiler.print_summary()
+    if isinstance(json_path, str):
+        profiler.write_json(json_path)
+
 
 # === Export Functions ===
-def export_to_tsv(headers, rows, output_path, encoding=EXPORT_ENCODING):
-    with open(output_path, 'w', newline='', encoding=encoding) as tsvfile:
-        writer = csv.DictWriter(tsvfile, fieldnames=headers, delimiter='\t', quoting=csv.QUOTE_ALL)
-        writer.writeheader()
-        writer.writerows([{h: str(row.get(h, "")) for h in headers} for row in rows])
-    print(f"Exported {len(rows)} rows to {output_path}")
+def format_csv_rows(rows, delimiter):
+    """
+    Formats rows of string values as csv.writer does with QUOTE_ALL: every value in
+    double quotes, quotes inside doubled, records ended by CRLF. Doubling a value's
+    quotes is one str.replace, where csv.writer looks at each character.
+    """
+    value_sep = '"' + delimiter + '"'
+    return "".join(['"' + value_sep.join([v.replace('"', '""') for v in values]) + '"\r\n' if values else "\r\n"
+                    for values in rows])
 
 
-def export_to_csv(headers, rows, output_path, encoding=EXPORT_ENCODING):
-    with open(output_path, 'w', newline='', encoding=encoding) as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=headers, delimiter=',', quoting=csv.QUOTE_ALL)
-        writer.writeheader()
-        writer.writerows([{h: str(row.get(h, "")) for h in headers} for row in rows])
-    print(f"Exported {len(rows)} rows to {output_path}")
+class RowWriter:
+    """
+    Incremental writer for CSV, TSV and DAT output.
+    Rows are tuples of string values in header order, written one at a time or in
+    batches, so one pass over an input can fill several outputs.
+    Formatted rows are collected as text and encoded together every WRITE_BATCH_ROWS
+    rows into a binary file. The encoder is incremental, so a BOM (UTF-16, UTF-8 with
+    BOM) is written once at the start of the file and never again.
+    Written rows are fed to profiler (a ColumnProfiler) when one is given; with
+    excel_check set, a profiler without distinct counts is created for the Excel
+    limit check if none is given.
+    With a checkpoint, write_rows saves it between batches when it is due, and a
+    loaded checkpoint is continued: the output is cut back to its checkpointed size
+    and the row count and statistics carry on from there.
+    With append set, rows are added to the end of an existing output_path.
+    """
+    def __init__(self, headers, output_path, fmt="dat", encoding=EXPORT_ENCODING, excel_check=False, write_header=True, profiler=None, buffer_size=WRITE_BUFFER_SIZE, checkpoint=None, append=False):
+        self.headers = headers
+        self.output_path = output_path
+        self.fmt = fmt
+        if profiler is None and excel_check:
+            profiler = ColumnProfiler(headers, distinct=False)
+        self.profiler = profiler
+        self.count = 0
+        self.checkpoint = checkpoint
+        self.encoder = codecs.getincrementalencoder(encoding)()
+        self.encoded = False  # Whether the encoder has produced output (and its BOM) yet
+        resume = checkpoint.state if checkpoint is not None else None
+        self.encode_behind = PIPELINE  # Text is encoded by the WriteBehindFile thread
+        if resume is None:
+            self.file = open(output_path, 'ab' if append else 'wb', buffering=buffer_size)
+        else:
+            position = resume["outputs"][output_path]
+            self.file = open(output_path, 'r+b', buffering=buffer_size)
+            self.file.truncate(position)  # Drop whatever was written after the checkpoint
+            self.file.seek(position)
+            self.encoder.setstate(resume["encoder_state"])  # No second BOM
+            self.encoded = True
+            self.count = resume["rows"]
+            if profiler is not None and resume["profiler"] is not None:
+                profiler.merge(resume["profiler"])
+            write_header = False
+        if self.encode_behind:
+            self.file = WriteBehindFile(self.file, self.encoder)
+        self.text = []  # Formatted rows waiting to be encoded
+        self.chunks = []  # Encoded bytes waiting to be written
+        self.pending = 0  # Rows in text and chunks
+        self.sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
+        self.record_join = QUOTE_CHAR + "\r\n" + QUOTE_CHAR  # Between the values of consecutive DAT records
+        # LazyRecords in this byte encoding are copied to DAT output without decoding
+        self.raw_codec = codecs.lookup(bomless_encoding(encoding)).name if fmt == "dat" else None
+        if self.raw_codec:
+            self.raw_quote = QUOTE_CHAR.encode(self.raw_codec)
+            self.raw_sep = self.sep.encode(self.raw_codec)
+            self.raw_end = (QUOTE_CHAR + "\r\n").encode(self.raw_codec)
+        self.delimiter = '\t' if fmt == "tsv" else ','
+        if write_header:
+            if fmt == "dat":
+                self.text.append(f"{QUOTE_CHAR}{self.sep.join(headers)}{QUOTE_CHAR}\r\n")
+            else:
+                self.text.append(format_csv_rows([headers], self.delimiter))
+
+    def write(self, row):
+        """Writes a row; same as write_values."""
+        self.write_values(row)
+
+    def write_values(self, values):
+        """Writes a row given as a sequence of string values (or a LazyRecord) in header order."""
+        if type(values) is LazyRecord:
+            if values.codec == self.raw_codec:
+                self.count += 1
+                if self.profiler is not None:
+                    self.profiler.add(values)
+                self.write_raw(values.fields)
+                return
+            values = values.values()
+        self.count += 1
+        if self.profiler is not None:
+            self.profiler.add(values)
+        if self.fmt == "dat":
+            self.text.append(f"{QUOTE_CHAR}{self.sep.join(values)}{QUOTE_CHAR}\r\n")
+        else:
+            self.text.append(format_csv_rows([values], self.delimiter))
+        self.row_written(1)
+
+    def write_rows(self, rows):
+        """
+        Writes an iterable of rows. Rows of values are formatted WRITE_BATCH_ROWS at a
+        time, with one join per batch.
+        """
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, WRITE_BATCH_ROWS))
+            if not batch:
+                return
+            if type(batch[0]) is LazyRecord and batch[0].codec == self.raw_codec:
+                for values in batch:
+                    self.write_values(values)  # Copied through as bytes
+            else:
+                if type(batch[0]) is LazyRecord:
+                    batch = [values.values() if type(values) is LazyRecord else values for values in batch]
+                self.write_batch(batch)
+            if self.checkpoint is not None and self.checkpoint.due():
+                self.checkpoint.save_progress(self)  # Every row read so far has been written
+
+    def write_batch(self, rows):
+        """Writes a list of rows of string values."""
+        self.count += len(rows)
+        if self.profiler is not None:
+            for values in rows:
+                self.profiler.add(values)
+        if self.fmt == "dat":
+            sep = self.sep
+            self.text.append(QUOTE_CHAR + self.record_join.join(map(sep.join, rows)) + QUOTE_CHAR + "\r\n")
+        else:
+            self.text.append(format_csv_rows(rows, self.delimiter))
+        self.row_written(len(rows))
+
+    def write_record(self, line):
+        """Writes a DAT record that is already in canonical þvalueþ framing, without re-parsing it."""
+        self.count += 1
+        if self.profiler is not None:
+            self.profiler.add(tuple(strip_one_quote(v) for v in line.split(self.sep)))
+        self.text.append(line + "\r\n")
+        self.row_written(1)
+
+    def write_raw(self, fields):
+        """
+        Writes DAT field values that are already encoded in the output encoding.
+        Line breaks inside them are translated as decode_field would.
+        """
+        if self.text or not self.encoded:
+            self.encode_text()  # Keeps rows in order and puts any BOM first
+        data = self.raw_quote + self.raw_sep.join(fields)
+        if b'\r' in data:
+            data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        self.chunks.append(data + self.raw_end)
+        self.row_written(1)
+
+    def row_written(self, n):
+        self.pending += n
+        if self.pending >= WRITE_BATCH_ROWS:
+            self.flush()
+
+    def encode_text(self):
+        text = "".join(self.text)
+        self.chunks.append(text if self.encode_behind else self.encoder.encode(text))
+        self.text.clear()
+        self.encoded = True
+
+    def flush(self):
+        """Encodes the collected rows and hands them to the file."""
+        if self.text:
+            self.encode_text()
+        self.file.writelines(self.chunks)
+        self.chunks.clear()
+        self.pending = 0
+
+    def sync(self):
+        """Flushes the rows written so far to disk and returns the state a checkpoint needs to continue the file."""
+        self.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.profiler is not None:
+            self.profiler.flush()
+        return {"outputs": {self.output_path: self.file.tell()}, "rows": self.count,
+                "encoder_state": self.encoder.getstate(), "profiler": self.profiler}
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        if self.profiler is not None:
+            self.profiler.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_to_tsv(headers, rows, output_path, encoding=EXPORT_ENCODING, stats=None, checkpoint=None):
+    with timed_stage("write"), RowWriter(headers, output_path, "tsv", encoding, excel_check=True, profiler=stats, checkpoint=checkpoint) as writer:
+        writer.write_rows(rows)
+    writer.profiler.print_excel_summary()
+    print(f"Exported {writer.count} rows to {output_path}")
+    return writer.count
+
+
+def export_to_csv(headers, rows, output_path, encoding=EXPORT_ENCODING, stats=None, checkpoint=None):
+    with timed_stage("write"), RowWriter(headers, output_path, "csv", encoding, excel_check=True, profiler=stats, checkpoint=checkpoint) as writer:
+        writer.write_rows(rows)
+    writer.profiler.print_excel_summary()
+    print(f"Exported {writer.count} rows to {output_path}")
+    return writer.count
+
+
+def export_to_dat(headers, rows, output_path, encoding=EXPORT_ENCODING, stats=None, checkpoint=None):
+    with timed_stage("write"), RowWriter(headers, output_path, "dat", encoding, profiler=stats, checkpoint=checkpoint) as writer:
+        writer.write_rows(rows)
+    print(f"Exported {writer.count} rows to {output_path}")
+    return writer.count
+
+# === Raw Passthrough ===
+PASSTHROUGH_BLOCK_SIZE = 16 * 1024 * 1024  # Bytes read per block when a DAT body is copied through
+PASSTHROUGH_SAMPLE_SIZE = 1024 * 1024  # Bytes of the first block, checked before any output is written
+
+
+def canonical_block_rows(block, field_count, codec=None):
+    """
+    Returns the number of records in block (whole DAT records, each ending in a quote
+    and CR LF) if all of them are already in the form RowWriter writes: field_count
+    quoted values with no quote or carriage return inside a value, so that parsing and
+    writing them again gives the same records. Returns None otherwise.
+    block is text, or bytes in codec for encodings with one-byte code units.
+    """
+    quote, sep, cr, lf = QUOTE_CHAR, QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR, "\r", "\n"
+    if codec is not None:
+        quote, sep, cr, lf = (s.encode(codec) for s in (quote, sep, cr, lf))
+    kind = type(block)
+    lines = block.split(cr)  # One per record, the ones after the first starting with the LF of the line break
+    records, rows = lines[:-1], len(lines) - 1
+    if (lines[-1] != lf or not lines[0].startswith(quote) or lines[0] == quote or lf + quote in lines
+            or not all(map(kind.startswith, lines[1:-1], itertools.repeat(lf + quote)))
+            or not all(map(kind.endswith, records, itertools.repeat(quote)))):
+        return None  # Line breaks or quotes outside the record framing
+    if (lines[0].startswith(sep) or any(map(kind.startswith, lines[1:-1], itertools.repeat(lf + sep)))
+            or any(map(kind.endswith, records, itertools.repeat(sep)))):
+        return None  # A first or last value the parser would split differently
+    if set(map(kind.count, records, itertools.repeat(sep))) != {field_count - 1}:
+        return None
+    # With field_count - 1 separators in every record, this quote total leaves no quotes inside values.
+    # The last byte of a quote is quicker to count; only other characters that contain it need a full count.
+    quotes = 2 * field_count * rows
+    if block.count(quote[-1:]) != quotes and block.count(quote) != quotes:
+        return None
+    return rows
+
+
+def canonical_dat_blocks(file_path, encoding, field_count, decode=False):
+    """
+    Reads the records after the header of a DAT file in blocks cut at record ends and
+    yields (chunk, text, rows) for each block that passes canonical_block_rows with
+    field_count fields: its bytes, its text and its number of records. The text is
+    the bytes again for encodings with one-byte code units, unless decode is set.
+    The header record is checked with the first block, which is only
+    PASSTHROUGH_SAMPLE_SIZE bytes so that most other files are turned down after a
+    short read; later blocks are PASSTHROUGH_BLOCK_SIZE bytes.
+    Yields None and stops at the first block that does not pass, or that has no
+    record end at all (records ending in a bare LF, or one longer than the block).
+    """
+    codec, data_start, unit = raw_layout(file_path, encoding)
+    as_bytes = unit == 1 and not decode  # Bytes are never decoded, as with LazyRecords
+    end = (QUOTE_CHAR + "\r\n").encode(codec)
+    check_codec = codec if as_bytes else None
+    header_checked = False
+    size = PASSTHROUGH_SAMPLE_SIZE
+    carry = b''
+    with open(file_path, 'rb') as f:
+        f.seek(data_start)
+        while True:
+            block = f.read(size)
+            data = carry + block
+            if block:
+                cut = data.rfind(end)
+                while cut > 0 and cut % unit:  # A record end starts on a code unit boundary
+                    cut = data.rfind(end, 0, cut + len(end) - 1)
+                if cut < 0:
+                    if len(block) == size:
+                        yield None
+                        return
+                    carry = data  # The end of the file is near, its last record has no line break
+                    continue
+                cut += len(end)
+            elif data:
+                data += "\r\n".encode(codec)  # The last record has no line break, RowWriter adds one
+                cut = len(data)
+            elif header_checked:
+                return
+            else:
+                yield None  # No header record
+                return
+            size = PASSTHROUGH_BLOCK_SIZE
+            chunk, carry = data[:cut], data[cut:]
+            if as_bytes:
+                text = chunk
+            else:
+                try:
+                    text = chunk.decode(codec)
+                except UnicodeDecodeError:
+                    yield None
+                    return
+            if not header_checked:
+                header_end = end if as_bytes else QUOTE_CHAR + "\r\n"
+                header = text[:text.find(header_end) + len(header_end)]
+                if canonical_block_rows(header, field_count, check_codec) != 1:
+                    yield None
+                    return
+                header_checked = True
+                text = text[len(header):]
+                chunk = text if as_bytes else chunk[len(header.encode(codec)):]
+            if text:
+                rows = canonical_block_rows(text, field_count, check_codec)
+                if rows is None:
+                    yield None
+                    return
+                yield chunk, text, rows
+            if not block:
+                return
+
+
+def canonical_dat_start(file_path, encoding, field_count):
+    """Whether the header and the first block of a DAT file pass canonical_dat_blocks; a quick check before copying."""
+    return next(canonical_dat_blocks(file_path, encoding, field_count), ()) is not None
+
+
+def copy_dat_body(file_path, encoding, field_count, out, out_encoding):
+    """
+    Copies the records after the header of a DAT file into the binary file out, in
+    out_encoding without a BOM, when every block passes canonical_dat_blocks.
+    Blocks are written as they were read when both encodings give the same bytes, or
+    transcoded through an incremental encoder.
+    Returns the number of records copied, or None as soon as a block does not pass,
+    leaving a partial copy in out.
+    """
+    codec = raw_layout(file_path, encoding)[0]
+    out_codec = codecs.lookup(bomless_encoding(out_encoding)).name
+    encode = None if out_codec == codec else codecs.getincrementalencoder(out_codec)().encode
+    rows = 0
+    for block in canonical_dat_blocks(file_path, encoding, field_count, decode=encode is not None):
+        if block is None:
+            return None
+        chunk, text, count = block
+        out.write(chunk if encode is None else encode(text))
+        rows += count
+    return rows
+
+
+def passthrough_dat(input_file_path, encoding, headers, output_path):
+    """
+    Writes output_path as a DAT file in encoding with the given header record and the
+    body of input_file_path copied through by copy_dat_body, without parsing it.
+    The copy saves no checkpoints, so an interrupted passthrough cannot be resumed;
+    --resume starts it again on the parsing path.
+    Returns the number of rows, or None (removing the output) if the body has to be
+    parsed instead.
+    """
+    if not canonical_dat_start(input_file_path, encoding, len(headers)):
+        return None
+    header = QUOTE_CHAR + (QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR).join(headers) + QUOTE_CHAR + "\r\n"
+    with timed_stage("write"), open(output_path, 'wb') as out:
+        out.write(codecs.encode(header, encoding))  # With the BOM of the encoding, as RowWriter writes it
+        rows = copy_dat_body(input_file_path, encoding, len(headers), out, encoding)
+    if rows is None:
+        os.remove(output_path)
+        return None
+    print(f"Exported {rows} rows to {output_path}")
+    return rows
 
 
-def export_to_dat(headers, rows, output_path, encoding=EXPORT_ENCODING):
-    sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
-    with open(output_path, 'w', encoding=encoding, newline='') as f:
-        header_line = sep.join(headers)
-        f.write(f"{QUOTE_CHAR}{header_line}{QUOTE_CHAR}\r\n")
-        for row in rows:
-            fields = [str(row.get(h, '')) for h in headers]
-            line = sep.join(fields)
-            f.write(f"{QUOTE_CHAR}{line}{QUOTE_CHAR}\r\n")
-    print(f"Exported {len(rows)} rows to {output_path}")
+# === Checkpoints ===
+CHECKPOINT_INTERVAL = 60  # Seconds between checkpoints of a streaming convert, select, replace-header or merge
+CHECKPOINT_VERSION = 1
+
+
+def file_signature(path):
+    """Absolute path, size and modification time of a file, to tell whether it changed."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+def sync_file(path):
+    """Forces what has been written to path onto the disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Checkpoint:
+    """
+    Progress of a long streaming run, saved every interval seconds to a .ckpt file next
+    to its output so that --resume can continue it after a crash.
+    The outputs are flushed to disk before each save, and the file is replaced
+    atomically, so a checkpoint never points past what was really written. Outputs
+    are cut back to their checkpointed size on resume, which drops any partial tail.
+    job identifies the run (operation, input, output and options); a checkpoint of a
+    different run is ignored.
+    """
+    def __init__(self, path, job, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.job = job
+        self.interval = interval
+        self.state = None  # Loaded state to resume from
+        self.tracker = None  # Start offset of the last record read, kept by the input's RecordScanner
+        self.offset_unit = None  # "byte" or "char", depending on how the input is scanned
+        self.last_saved = time.monotonic()
+
+    def due(self):
+        return self.interval > 0 and time.monotonic() - self.last_saved >= self.interval
+
+    def track(self, offset_unit, offsets=None):
+        """
+        Returns the offsets sequence to give the input's RecordScanner, and the
+        offset at which to resume scanning if there is one (the last record read
+        before the checkpoint is read again there and skipped).
+        """
+        self.offset_unit = offset_unit
+        self.tracker = offsets if offsets is not None else deque(maxlen=1)
+        if self.state is None:
+            return self.tracker, None
+        if self.state["offset_unit"] != offset_unit:
+            raise ValueError(f"Checkpoint {self.path} was written while reading the input differently, cannot resume")
+        return self.tracker, self.state["input_offset"]
+
+    def save(self, state):
+        state = dict(state, version=CHECKPOINT_VERSION, job=self.job, saved=datetime.now().isoformat(timespec="seconds"))
+        part_path = self.path + ".part"
+        with open(part_path, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(part_path, self.path)
+        self.last_saved = time.monotonic()
+
+    def save_progress(self, writer):
+        """Saves a single-file run, whose rows up to the last record read are all in writer."""
+        state = writer.sync()
+        state["input_offset"] = self.tracker[-1]
+        state["offset_unit"] = self.offset_unit
+        self.save(state)
+
+    def load(self):
+        """Reads the checkpoint for --resume. Returns its state, or None to start from the beginning."""
+        if not os.path.isfile(self.path):
+            print(f"ℹ️ No checkpoint found at {self.path}, starting from the beginning.")
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Cannot read checkpoint {self.path} ({e}), starting from the beginning.")
+            return None
+        if state.get("version") != CHECKPOINT_VERSION or state.get("job") != self.job:
+            print(f"⚠️ Checkpoint {self.path} belongs to a different run or the input has changed, starting from the beginning.")
+            return None
+        for path, size in state["outputs"].items():
+            if not os.path.isfile(path) or os.path.getsize(path) < size:
+                print(f"⚠️ Output {path} is shorter than its checkpoint, starting from the beginning.")
+                return None
+        print(f"⏩ Resuming from the checkpoint saved at {state['saved']}.")
+        self.state = state
+        return state
+
+    def remove(self):
+        """Deletes the checkpoint once the run has finished."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def start_checkpoint(path, job, args):
+    """
+    Returns the Checkpoint of a run, loaded when args.resume is set, or None when
+    checkpoints are turned off (--checkpoint-interval 0 without --resume).
+    """
+    interval = getattr(args, "checkpoint_interval", CHECKPOINT_INTERVAL)
+    resume = getattr(args, "resume", False)
+    if interval <= 0 and not resume:
+        return None
+    checkpoint = Checkpoint(path, job, interval)
+    if resume:
+        checkpoint.load()
+    return checkpoint
+
 
 # === Mapping Header Function ===
 
@@ -316,34 +2462,303 @@ def load_mapping_file(mapping_file):
     return header_map
 
 
-# === Compare DAT Files ===
-def compare_dat_files(file1_path, file2_path, MAP=None):
+# === Hash Join ===
+def read_partition(path):
+    """Yields the (key, values) pairs pickled into a partition file."""
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
 
-    # Detect encodings for both files
-    encode1 = detect_encoding(file1_path, os.path.basename(file1_path))
-    encode2 = detect_encoding(file2_path, os.path.basename(file2_path))
 
-    if encode1 in ('Error', 'No File') or encode2 in ('Error', 'No File'):
-        print("Failed to detect encoding for one or both files.")
-        return None, None  # Return None for headers and diffs
+def write_batches(path, items, batch_size=SPILL_BATCH_ROWS):
+    """Writes items to a temp file, pickled together in lists of batch_size."""
+    with open(path, 'wb') as f:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+                batch = []
+        if batch:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
 
-    # Read lines from both files
-    def get_headers_and_rows(file_path, encoding):
-        headers = []
-        rows = []
-        for i, line in enumerate(read_dat_file_smart(file_path, encoding)):
-            if i == 0:
-                headers = [strip_one_quote(h) for h in line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
+
+def read_batches(path):
+    """Yields the items of a file written by write_batches."""
+    for batch in read_partition(path):
+        yield from batch
+
+
+def build_key_index(pairs, budget_bytes):
+    """
+    Builds {key: values} from (key, values) pairs. Records whose key is already indexed
+    are returned separately. Returns None if the index grows past budget_bytes.
+    """
+    index = {}
+    extras = []
+    used = 0
+    getsize = sys.getsizeof
+    with gc_paused():  # Only while the index grows; the rows joined against it run with GC on
+        for k, values in pairs:
+            used += 100 + getsize(k) + getsize(values) + sum(map(getsize, values))
+            if used > budget_bytes:
+                return None
+            if k in index:
+                extras.append((k, values))
             else:
-                parsed = parse_line(line, headers)
-                if parsed:
-                    rows.append(parsed)
-        return headers, rows
+                index[k] = values
+    return index, extras
 
-    headers1, rows1 = get_headers_and_rows(file1_path, encode1)
-    headers2, rows2 = get_headers_and_rows(file2_path, encode2)
 
-    # Mapping logic
+def join_by_key(make_build, make_probe, memory_budget=DEFAULT_MEMORY_BUDGET_MB, size_hint=0, outer=True):
+    """
+    Full outer hash join of two (key, values) streams, given as functions that return
+    a fresh iterator. Yields (key, build_values, probe_values) with None for the side
+    that has no record. Records come in probe order, followed by unmatched build records.
+    With outer=False, a build record matches every probe record with its key, and only
+    the build records that repeat an earlier key are returned unmatched (a left join).
+    If the build index does not fit in memory_budget (MB), the build records and the
+    probe keys, tagged with their sequence numbers, are hash partitioned to temp files
+    and matched one partition at a time; the results then come out in the same order
+    as in memory.
+    """
+    budget_bytes = memory_budget * 1024 * 1024
+    built = build_key_index(make_build(), budget_bytes)
+    if built is not None:
+        yield from probe_key_index(built, make_probe(), outer)
+        return
+
+    partitions = min(256, max(2, -(-size_hint * 3 // max(budget_bytes, 1))))  # Keep open file handles bounded
+    print(f"ℹ️ Key index exceeds {memory_budget} MB, joining through {partitions} temp partitions.")
+    with tempfile.TemporaryDirectory(prefix="join_") as tmp_dir:
+        def partition_path(name, p):
+            return os.path.join(tmp_dir, f"{name}_{p}")
+
+        def partition_of(k):
+            return zlib.crc32(k.encode('utf-8', 'surrogatepass')) % partitions
+
+        files = [open(partition_path("build", p), 'wb') for p in range(partitions)]
+        try:
+            for seq, (k, values) in enumerate(make_build()):
+                pickle.dump((k, (seq, values)), files[partition_of(k)], pickle.HIGHEST_PROTOCOL)
+        finally:
+            for f in files:
+                f.close()
+        probe_path = os.path.join(tmp_dir, "probe")
+        files = [open(partition_path("keys", p), 'wb') for p in range(partitions)]
+        try:
+            def probe_pairs():
+                for seq, (k, values) in enumerate(make_probe()):
+                    pickle.dump((seq, k), files[partition_of(k)], pickle.HIGHEST_PROTOCOL)
+                    yield k, values
+            write_batches(probe_path, probe_pairs())
+        finally:
+            for f in files:
+                f.close()
+
+        # Per partition, in seq order: the (seq, build_values) of matched probe records, and
+        # the (seq, key, values) of unmatched build records and of those repeating a key
+        by_seq = operator.itemgetter(0)
+        for p in range(partitions):
+            index, extras = build_key_index(read_partition(partition_path("build", p)), float('inf'))
+            lookup = index.pop if outer else index.get
+            with open(partition_path("matches", p), 'wb') as f:
+                for seq, k in read_partition(partition_path("keys", p)):
+                    entry = lookup(k, None)
+                    if entry is not None:
+                        pickle.dump((seq, entry[1]), f, pickle.HIGHEST_PROTOCOL)
+            with open(partition_path("unmatched", p), 'wb') as f:
+                for k, (seq, values) in index.items() if outer else ():
+                    pickle.dump((seq, k, values), f, pickle.HIGHEST_PROTOCOL)
+            with open(partition_path("extras", p), 'wb') as f:
+                for k, (seq, values) in extras:
+                    pickle.dump((seq, k, values), f, pickle.HIGHEST_PROTOCOL)
+            index = extras = None
+
+        matches = merge(*(read_partition(partition_path("matches", p)) for p in range(partitions)), key=by_seq)
+        match = next(matches, None)
+        for seq, (k, values) in enumerate(read_batches(probe_path)):
+            if match is not None and match[0] == seq:
+                yield k, match[1], values
+                match = next(matches, None)
+            else:
+                yield k, None, values
+        for name in ("unmatched", "extras"):
+            for _, k, values in merge(*(read_partition(partition_path(name, p)) for p in range(partitions)), key=by_seq):
+                yield k, values, None
+
+
+def probe_key_index(built, probe_pairs, outer=True):
+    index, extras = built
+    lookup = index.pop if outer else index.get
+    for k, values in probe_pairs:
+        yield k, lookup(k, None), values
+    if outer:
+        for k, values in index.items():
+            yield k, values, None
+    for k, values in extras:
+        yield k, values, None
+
+
+# === Deduplication ===
+DEDUPE_PARTITIONS = 128  # Temp partitions once digests exceed the memory budget
+DIGEST_ENTRY_BYTES = 100  # A 16-byte digest in a set, with object and hash table overhead
+DEDUPE_KEY = struct.Struct('<Q16s')  # Sequence number and digest of a spilled item
+
+
+def dedupe_digest(values, column=None, salt=b''):
+    """
+    Digest of a row's key value at column, or of the whole record when column is None.
+    Returns None for an empty key, so rows without one are never duplicates.
+    """
+    if column is None:
+        return record_digest(values.values() if type(values) is LazyRecord else values, salt)
+    value = values[column].strip()
+    if not value:
+        return None
+    return hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=16, salt=salt).digest()
+
+
+class Deduper:
+    """
+    Tells first occurrences from duplicates in a stream of (digest, payload) items.
+    Digests are kept in a set while it fits in memory_budget (MB). Beyond that, the
+    digests seen so far and those of all later items are hash partitioned into temp
+    files, the later payloads go to one temp file in order, and finish() decides the
+    items one partition at a time, so memory stays bounded and the work stays linear.
+    A digest of None is never a duplicate.
+    """
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET_MB, partitions=DEDUPE_PARTITIONS):
+        self.memory_budget = memory_budget
+        self.limit = max(memory_budget * 1024 * 1024 // DIGEST_ENTRY_BYTES, 1)
+        self.partitions = partitions
+        self.seen = set()
+        self.spill_dir = None
+        self.keys = None  # Per partition: file of (seq, digest) records
+        self.payloads = None
+        self.batch = []  # Payloads not yet written
+        self.seq = 0  # Items spilled so far
+        self.duplicates = 0
+
+    def push(self, digest, payload):
+        """
+        Returns whether digest was seen before, or None once digests have spilled to
+        disk; spilled items are returned by finish() in the order they were pushed.
+        """
+        if self.spill_dir is None:
+            if digest is None:
+                return False
+            if digest in self.seen:
+                self.duplicates += 1
+                return True
+            if len(self.seen) < self.limit:
+                self.seen.add(digest)
+                return False
+            self.spill()
+        if digest is not None:
+            self.keys[digest[0] % self.partitions].write(DEDUPE_KEY.pack(self.seq, digest))
+        self.batch.append(payload)
+        if len(self.batch) >= SPILL_BATCH_ROWS:
+            pickle.dump(self.batch, self.payloads, pickle.HIGHEST_PROTOCOL)
+            self.batch = []
+        self.seq += 1
+        return None
+
+    def spill(self):
+        print(f"ℹ️ Dedupe digests exceed {self.memory_budget} MB, deciding the remaining rows through {self.partitions} temp partitions.")
+        self.spill_dir = tempfile.mkdtemp(prefix="dedupe_")
+        seen = [[] for _ in range(self.partitions)]
+        for digest in self.seen:
+            seen[digest[0] % self.partitions].append(digest)
+        self.seen = None
+        for p, digests in enumerate(seen):
+            with open(os.path.join(self.spill_dir, f"seen_{p}"), 'wb') as f:
+                f.write(b''.join(digests))
+        self.keys = [open(os.path.join(self.spill_dir, f"keys_{p}"), 'wb') for p in range(self.partitions)]
+        self.payloads = open(os.path.join(self.spill_dir, "payloads"), 'wb')
+
+    def finish(self):
+        """Yields (is_duplicate, payload) for the spilled items, in the order they were pushed."""
+        if self.spill_dir is None:
+            return
+        try:
+            if self.batch:
+                pickle.dump(self.batch, self.payloads, pickle.HIGHEST_PROTOCOL)
+            self.payloads.close()
+            for f in self.keys:
+                f.close()
+            flags_path = os.path.join(self.spill_dir, "flags")
+            with open(flags_path, 'w+b') as f:
+                f.truncate(max(self.seq, 1))
+                with mmap.mmap(f.fileno(), 0) as flags:  # One byte per spilled item, set for duplicates
+                    # One partition at a time: its digests fit in memory
+                    for p in range(self.partitions):
+                        with open(os.path.join(self.spill_dir, f"seen_{p}"), 'rb') as g:
+                            data = g.read()
+                        seen = {data[i:i + 16] for i in range(0, len(data), 16)}
+                        with open(os.path.join(self.spill_dir, f"keys_{p}"), 'rb') as g:
+                            data = g.read()
+                        for seq, digest in DEDUPE_KEY.iter_unpack(data):
+                            if digest in seen:
+                                flags[seq] = 1
+                            else:
+                                seen.add(digest)
+                        seen = data = None
+                    for seq, payload in enumerate(read_batches(os.path.join(self.spill_dir, "payloads"))):
+                        duplicate = flags[seq] == 1
+                        if duplicate:
+                            self.duplicates += 1
+                        yield duplicate, payload
+        finally:
+            self.close()
+
+    def close(self):
+        """Removes the temp files, if digests spilled."""
+        if self.spill_dir is None:
+            return
+        for f in self.keys + [self.payloads]:
+            f.close()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def dedupe_rows(rows, column, duplicates, memory_budget=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Yields the first row of each key (the value at column, or the whole record when
+    column is None) and writes the later ones to duplicates, a RowWriter.
+    Rows with an empty key are always kept.
+    """
+    deduper = Deduper(memory_budget)
+    codec = None
+    try:
+        for values in rows:
+            payload = values
+            if type(values) is LazyRecord:
+                codec = values.codec
+                payload = values.fields  # Pickled much faster than the record, if spilled
+            duplicate = deduper.push(dedupe_digest(values, column), payload)
+            if duplicate:
+                duplicates.write_values(values)
+            elif duplicate is not None:
+                yield values
+        for duplicate, values in deduper.finish():
+            if codec:
+                values = LazyRecord(values, codec)
+            if duplicate:
+                duplicates.write_values(values)
+            else:
+                yield values
+    finally:
+        deduper.close()
+
+
+# === Compare DAT Files ===
+def resolve_mapped_headers(headers1, headers2, MAP):
+    """
+    Returns the aligned header lists to compare, or None when nothing can be compared.
+    """
     if MAP:
         # MAP is expected to be {header_from_file1: header_from_file2}
         valid_mapped_headers = [
@@ -353,68 +2768,585 @@ def compare_dat_files(file1_path, file2_path, MAP=None):
 
         if not valid_mapped_headers:
             print("No valid header mappings found — check your mapping file and headers.")
-            return None, None
+            return None
 
         # Split into two aligned lists
-        mapped_headers1, mapped_headers2 = zip(*valid_mapped_headers)
-    else:
-        # If no mapping provided, require exact header match
-        if headers1 != headers2:
-            print("Headers do not match and no mapping file provided.")
-            return None, None
-        mapped_headers1 = headers1
-        mapped_headers2 = headers2
+        return zip(*valid_mapped_headers)
+    # If no mapping provided, require exact header match
+    if headers1 != headers2:
+        print("Headers do not match and no mapping file provided.")
+        return None
+    return headers1, headers2
+
+
+def record_digest(values, salt=b''):
+    """Digest of a record's compared values; equal digests mean the values are equal."""
+    data = FIELD_SEP.join(values) + '\x00' + ','.join([str(len(v)) for v in values])
+    return hashlib.blake2b(data.encode('utf-8', 'surrogatepass'), digest_size=16, salt=salt).digest()
+
+
+def compared_values(file_path, encoding, columns):
+    """
+    Returns a function that streams (key, (digest, *values)) for each valid record of a
+    DAT file, taking the key and the compared values from the given column names.
+    """
+    def pairs(key_field=None):
+        schema, records = iter_record_values(file_path, encoding)
+        index = schema.index  # Last one wins for repeated names
+        cols = [index[h] for h in columns]
+        key_idx = index[key_field] if key_field else None
+        for values in records:
+            if values is not None:
+                picked = [values[c] for c in cols]
+                yield (values[key_idx] if key_idx is not None else None), (record_digest(picked), *picked)
+    return pairs
+
+
+def compare_dat_files_by_key(file1_path, encode1, file2_path, encode2, MAP, key, memory_budget=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Compares two DAT files record by record, matching records on the key field instead of
+    their position. The smaller file is indexed and the larger one streamed against it.
+    Returns fieldnames and a generator of Added, Removed and Changed diffs.
+    """
+    headers1 = iter_record_values(file1_path, encode1)[0].headers
+    headers2 = iter_record_values(file2_path, encode2)[0].headers
+    mapped = resolve_mapped_headers(headers1, headers2, MAP)
+    if mapped is None:
+        return None, None
+    mapped_headers1, mapped_headers2 = mapped
+    key2 = MAP.get(key, key) if MAP else key
+    if key not in headers1 or key2 not in headers2:
+        print(f"❌ Key field '{key}' not found in both files.")
+        return None, None
+
+    pairs1 = compared_values(file1_path, encode1, mapped_headers1)
+    pairs2 = compared_values(file2_path, encode2, mapped_headers2)
+    side1 = lambda: pairs1(key)
+    side2 = lambda: pairs2(key2)
+    size1, size2 = os.path.getsize(file1_path), os.path.getsize(file2_path)
 
     # Prepare filenames
     File1_Value = os.path.basename(file1_path)
     File2_Value = os.path.basename(file2_path)
+    field_names = [h1 if h1 == h2 else f"{h1} ↔ {h2}" for h1, h2 in zip(mapped_headers1, mapped_headers2)]
+
+    def diffs():
+        counts = {"Added": 0, "Removed": 0, "Changed": 0}
+        if size1 <= size2:
+            joined = join_by_key(side1, side2, memory_budget, size1)
+        else:
+            joined = ((k, v1, v2) for k, v2, v1 in join_by_key(side2, side1, memory_budget, size2))
+        for k, values1, values2 in joined:
+            if values1 is None or values2 is None:
+                status = "Added" if values1 is None else "Removed"
+                counts[status] += 1
+                yield (k, status, "", "", "")
+                continue
+            if values1[0] == values2[0]:
+                continue  # Digests match, skip the field-by-field check
+            counts["Changed"] += 1
+            for field, v1, v2 in zip(field_names, values1[1:], values2[1:]):
+                if v1 != v2:
+                    yield (k, "Changed", field, v1, v2)
+
+        print(f"🔑 Compared on '{key}': {counts['Added']} added, {counts['Removed']} removed, {counts['Changed']} changed record(s).")
+        if not any(counts.values()):
+            print("No differences found.")
+
+    fieldnames = [key, "Status", "Field", File1_Value, File2_Value]
+    return fieldnames, instrument(diffs(), "compare")
+
+
+def compare_dat_files(file1_path, file2_path, MAP=None, key=None, memory_budget=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Compares two DAT files by position, or on a key field when key is given.
+    Returns the diff fieldnames and a generator that yields differences while both
+    files are streamed, or (None, None) when the files cannot be compared.
+    """
+
+    # Detect encodings for both files
+    encode1 = detect_encoding(file1_path, os.path.basename(file1_path))
+    encode2 = detect_encoding(file2_path, os.path.basename(file2_path))
 
-    # Compare row values
-    diffs = []
-    row_count = min(len(rows1), len(rows2))
-    for idx in range(row_count):
-        r1 = rows1[idx]
-        r2 = rows2[idx]
-        for h1, h2 in zip(mapped_headers1, mapped_headers2):
-            v1 = r1.get(h1, "")
-            v2 = r2.get(h2, "")
-            if v1 != v2:
-                diffs.append({
-                    "Row": idx + 2,  # +2 accounts for header and 1-based indexing
-                    "Field": h1 if h1 == h2 else f"{h1} ↔ {h2}",
-                    File1_Value: v1,
-                    File2_Value: v2
-                })
-
-    if not diffs:
-        print("No differences found.")
+    if encode1 in ('Error', 'No File') or encode2 in ('Error', 'No File'):
+        print("Failed to detect encoding for one or both files.")
+        return None, None  # Return None for headers and diffs
+
+    if key:
+        return compare_dat_files_by_key(file1_path, encode1, file2_path, encode2, MAP, key, memory_budget)
+
+    headers1 = iter_record_values(file1_path, encode1)[0].headers
+    headers2 = iter_record_values(file2_path, encode2)[0].headers
+
+    # Mapping logic
+    mapped = resolve_mapped_headers(headers1, headers2, MAP)
+    if mapped is None:
         return None, None
+    mapped_headers1, mapped_headers2 = mapped
+
+    # Prepare filenames
+    File1_Value = os.path.basename(file1_path)
+    File2_Value = os.path.basename(file2_path)
+    field_names = [h1 if h1 == h2 else f"{h1} ↔ {h2}" for h1, h2 in zip(mapped_headers1, mapped_headers2)]
+
+    # Row counts are known up front when both files are indexed
+    index1, index2 = load_dat_index(file1_path), load_dat_index(file2_path)
+    if index1 and index2 and index1.row_count != index2.row_count:
+        print(f"⚠️ {File1_Value} has {index1.row_count} rows and {File2_Value} has {index2.row_count}; "
+              f"only the first {min(index1.row_count, index2.row_count)} are compared.")
+    for index in (index1, index2):
+        if index:
+            index.close()
+
+    # Compare row values, streaming both files side by side
+    def diffs():
+        found = False
+        rows1 = compared_values(file1_path, encode1, mapped_headers1)()
+        rows2 = compared_values(file2_path, encode2, mapped_headers2)()
+        for idx, ((_, r1), (_, r2)) in enumerate(zip(rows1, rows2)):
+            if r1[0] == r2[0]:
+                continue  # Digests match, skip the field-by-field check
+            for field, v1, v2 in zip(field_names, r1[1:], r2[1:]):
+                if v1 != v2:
+                    found = True
+                    yield (str(idx + 2), field, v1, v2)  # +2 accounts for header and 1-based indexing
+        if not found:
+            print("No differences found.")
 
     fieldnames = ["Row", "Field", File1_Value, File2_Value]
-    return fieldnames, diffs
+    return fieldnames, instrument(diffs(), "compare")
 
-# === Replace Header ===
-def replace_header_and_collect(input_file_path, header_map, encoding):
+
+def summarize_diffs(fieldnames, diffs, bucket_size=10000):
     """
-    Reads a DAT file, replaces headers using header_map, and returns new headers and rows.
+    Aggregates a diff stream into counts per field and per row range (or per status for
+    keyed compares) without keeping the individual differences.
     """
-    new_headers = []
-    rows = []
-    for i, line in enumerate(read_dat_file_smart(input_file_path, encoding)): # Use read_dat_file_smart
-        if i == 0:
-            headers = [strip_one_quote(h) for h in line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
-            new_headers = [header_map.get(h, h) for h in headers]
+    per_field = OrderedDict()
+    per_range = OrderedDict()
+    per_status = OrderedDict()
+    field_idx = fieldnames.index("Field")
+    row_idx = fieldnames.index("Row") if "Row" in fieldnames else None
+    status_idx = fieldnames.index("Status") if "Status" in fieldnames else None
+    for diff in diffs:
+        if diff[field_idx]:
+            per_field[diff[field_idx]] = per_field.get(diff[field_idx], 0) + 1
+        if row_idx is not None:
+            start = (int(diff[row_idx]) - 2) // bucket_size * bucket_size + 2
+            label = f"{start}-{start + bucket_size - 1}"
+            per_range[label] = per_range.get(label, 0) + 1
         else:
-            # Use parse_line for consistent parsing
-            parsed_row = parse_line(line, headers) # Pass original headers to parse_line
-            if parsed_row:
-                # Map the keys of the parsed_row to new_headers
-                mapped_row = {new_headers[idx]: value for idx, (header, value) in enumerate(parsed_row.items())}
-                rows.append(mapped_row)
-    return new_headers, rows
+            per_status[diff[status_idx]] = per_status.get(diff[status_idx], 0) + 1
+    summary = [("Field", name, str(count)) for name, count in per_field.items()]
+    summary += [("Rows", label, str(count)) for label, count in per_range.items()]
+    summary += [("Status", status, str(count)) for status, count in per_status.items()]
+    return ["Scope", "Value", "Differences"], summary
+
+
+# === Row Filters ===
+# --where expressions, e.g.  CUSTODIAN in ("Smith", "Doe") and DATESENT >= 2020-01-01 and not TITLE is empty
+WHERE_TOKEN = re.compile(r"""\s*(?:(?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|(?P<field>\[[^\]]*\])|(?P<op>!=|>=|<=|\^=|=|>|<|~|\(|\)|,)|(?P<word>[^\s()=!<>~^,"'\[\]]+))""")
+WHERE_KEYWORDS = {"and", "or", "not", "in", "is", "empty", "contains", "startswith", "between"}
+RANGE_OPERATORS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%m/%d/%Y %H:%M:%S")
+
+
+def parse_number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def parse_date(value):
+    """Returns the date of a value in one of DATE_FORMATS, or None. Cached, as dates repeat a lot."""
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+class WhereParser:
+    """
+    Parses a --where expression into a tree of tuples:
+    ("or", [nodes]), ("and", [nodes]), ("not", node) and ("cmp", field, op, value).
+    Comparisons are  FIELD = v, != v, ^= v (prefix), ~ regex, > >= < <= v (number or date),
+    in (v, ...), not in (...), contains v, startswith v, between v and v, is [not] empty.
+    Values are quoted strings or bare words; [Field Name] quotes field names.
+    Raises ValueError on syntax errors.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = WHERE_TOKEN.match(text, pos)
+            if not m:
+                raise ValueError(f"Cannot read --where expression at: {text[pos:]}")
+            kind = m.lastgroup
+            token = m.group(kind)
+            if kind == "str":
+                token = re.sub(r"\\(.)", r"\1", token[1:-1])
+            elif kind == "field":
+                token = token[1:-1]
+            elif kind == "word" and token.lower() in WHERE_KEYWORDS:
+                kind, token = "keyword", token.lower()
+            self.tokens.append((kind, token))
+            pos = m.end()
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, token=None):
+        t = self.peek()
+        if t[0] is None or (kind and t[0] != kind) or (token and t[1] != token):
+            expected = token or kind or "more input"
+            raise ValueError(f"Expected {expected} in --where expression, got {t[1] or 'the end'}: {self.text}")
+        self.pos += 1
+        return t
+
+    def accept(self, kind, token=None):
+        t = self.peek()
+        if t[0] == kind and (token is None or t[1] == token):
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.pos][1]} in --where expression: {self.text}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.accept("keyword", "or"):
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.accept("keyword", "and"):
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def parse_not(self):
+        if self.accept("keyword", "not"):
+            return ("not", self.parse_not())
+        if self.accept("op", "("):
+            node = self.parse_or()
+            self.take("op", ")")
+            return node
+        return self.parse_comparison()
+
+    def value(self):
+        kind, token = self.peek()
+        if kind not in ("str", "word"):
+            self.take("value")
+        self.pos += 1
+        return token
+
+    def value_list(self):
+        self.take("op", "(")
+        values = [self.value()]
+        while self.accept("op", ","):
+            values.append(self.value())
+        self.take("op", ")")
+        return values
+
+    def parse_comparison(self):
+        kind, field = self.peek()
+        if kind not in ("word", "field", "str"):
+            self.take("field name")
+        self.pos += 1
+        kind, op = self.take()
+        if kind == "op" and op in ("=", "!=", "^=", "~") or op in RANGE_OPERATORS:
+            return ("cmp", field, op, self.value())
+        if (kind, op) == ("keyword", "in"):
+            return ("cmp", field, "in", self.value_list())
+        if (kind, op) == ("keyword", "not"):
+            self.take("keyword", "in")
+            return ("cmp", field, "not in", self.value_list())
+        if kind == "keyword" and op in ("contains", "startswith"):
+            return ("cmp", field, "^=" if op == "startswith" else op, self.value())
+        if (kind, op) == ("keyword", "between"):
+            low = self.value()
+            self.take("keyword", "and")
+            return ("cmp", field, "between", (low, self.value()))
+        if (kind, op) == ("keyword", "is"):
+            negate = self.accept("keyword", "not")
+            self.take("keyword", "empty")
+            return ("cmp", field, "is not empty" if negate else "is empty", None)
+        raise ValueError(f"Unknown comparison '{op}' after {field} in --where expression: {self.text}")
+
+
+def parse_where(text):
+    return WhereParser(text).parse()
+
+
+def where_fields(node):
+    """The field names used in a where tree."""
+    if node[0] == "cmp":
+        return {node[1]}
+    if node[0] == "not":
+        return where_fields(node[1])
+    return set().union(*(where_fields(child) for child in node[1]))
+
+
+def where_literals(node):
+    """
+    Strings that every matching record must contain verbatim, so records without them
+    can be skipped before they are split. Only comparisons that hold in every match
+    (all the parts of an and) contribute.
+    """
+    if node[0] == "cmp":
+        _, _, op, value = node
+        if op in ("=", "^=", "contains") and value and "\r" not in value and "\n" not in value:
+            return [value]
+        return []
+    if node[0] == "and":
+        return [literal for child in node[1] for literal in where_literals(child)]
+    return []
+
+
+def range_bound(value):
+    """Returns (converter, bound) for a range comparison against a number or a date."""
+    number = parse_number(value)
+    if number is not None:
+        return parse_number, number
+    date = parse_date(value)
+    if date is not None:
+        return parse_date, date
+    raise ValueError(f"'{value}' is neither a number nor a date ({', '.join(DATE_FORMATS[:3])})")
+
+
+def compile_where(node, schema):
+    """
+    Compiles a where tree into a predicate over rows in schema order (tuples or
+    LazyRecords, of which only the compared fields are decoded).
+    Raises ValueError for unknown fields or bad values.
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        predicates = [compile_where(child, schema) for child in node[1]]
+        combined = predicates[-1]
+        for predicate in reversed(predicates[:-1]):
+            if kind == "and":
+                combined = (lambda a, b: lambda row: a(row) and b(row))(predicate, combined)
+            else:
+                combined = (lambda a, b: lambda row: a(row) or b(row))(predicate, combined)
+        return combined
+    if kind == "not":
+        predicate = compile_where(node[1], schema)
+        return lambda row: not predicate(row)
+
+    _, field, op, value = node
+    if field not in schema.index:
+        raise ValueError(f"Field '{field}' in --where is not in the headers: {', '.join(schema.headers)}")
+    i = schema.index[field]
+    if op == "=":
+        return lambda row: row[i] == value
+    if op == "!=":
+        return lambda row: row[i] != value
+    if op == "^=":
+        return lambda row: row[i].startswith(value)
+    if op == "contains":
+        return lambda row: value in row[i]
+    if op == "~":
+        try:
+            search = re.compile(value).search
+        except re.error as e:
+            raise ValueError(f"Bad regular expression '{value}' in --where: {e}")
+        return lambda row: search(row[i]) is not None
+    if op in ("in", "not in"):
+        values = frozenset(value)
+        if op == "in":
+            return lambda row: row[i] in values
+        return lambda row: row[i] not in values
+    if op == "is empty":
+        return lambda row: not row[i]
+    if op == "is not empty":
+        return lambda row: bool(row[i])
+    if op == "between":
+        convert, low = range_bound(value[0])
+        high_convert, high = range_bound(value[1])
+        if high_convert is not convert:
+            raise ValueError(f"between needs two numbers or two dates, got {value[0]} and {value[1]}")
+
+        def between(row):
+            x = convert(row[i])
+            return x is not None and low <= x <= high
+        return between
+    convert, bound = range_bound(value)
+    compare = RANGE_OPERATORS[op]
+
+    def in_range(row):
+        x = convert(row[i])
+        return x is not None and compare(x, bound)
+    return in_range
+
+
+def make_prefilter(literals, sep, field_count):
+    """
+    Returns a test for raw records (str or bytes, like sep and literals) that can be
+    skipped without splitting: they lack one of the literals and have the right field
+    count, so malformed records still get through to be reported. None without literals.
+    """
+    if not literals:
+        return None
+    expected = field_count - 1
+    if len(literals) == 1:
+        literal = literals[0]
+        return lambda line: literal not in line and line.count(sep) == expected
+    return lambda line: not all(literal in line for literal in literals) and line.count(sep) == expected
+
+
+def pick_columns(values, columns):
+    """The values at columns of a row, as a LazyRecord if the row is one."""
+    if type(values) is LazyRecord:
+        fields = values.fields
+        return LazyRecord([fields[i] for i in columns], values.codec)
+    return tuple(values[i] for i in columns)
+
+
+def filter_rows(records, predicate):
+    """Valid records that match predicate (all valid records without one)."""
+    if predicate is None:
+        return (values for values in records if values is not None)
+    return (values for values in records if values is not None and predicate(values))
+
+
+# === Replace Header ===
+def replace_header_stream(input_file_path, header_map, encoding, jobs=1, where=None, checkpoint=None):
+    """
+    Reads the header record of a DAT file and replaces headers using header_map.
+    Returns the new headers and a generator that parses the remaining rows one at a
+    time, so the file is never held in memory. Only the schema changes; rows are
+    passed through as they are parsed.
+    where is an optional parse_where tree over the new headers; only matching rows
+    are returned. checkpoint is passed on to iter_record_values.
+    """
+    prefilter = where_literals(where) if where is not None else None
+    schema, records = iter_record_values(input_file_path, encoding, jobs, lazy=True, prefilter=prefilter, checkpoint=checkpoint)
+    new_schema = schema.rename(header_map)
+    predicate = compile_where(where, new_schema) if where is not None else None
+    return new_schema.headers, filter_rows(records, predicate)
 
 
 # === Merge DAT Files ===
+def header_group_hash(headers):
+    """Merge groups files by this hash of their headers."""
+    return hashlib.sha256("||".join(headers).encode()).hexdigest()
+
+
+def merge_file_part(path, fmt, encoding, part_path, stats=False, dedupe=None):
+    """
+    Validates one file from a merge manifest and streams its rows, without a header,
+    into part_path in the merge output format. With -j it runs in a worker process,
+    so the result is a small summary dict that Merge_dats assembles in manifest order.
+    part_path can also be a function that is given the headers and returns the group
+    output to append the rows to, as sequential merges do; if the file turns out
+    invalid, that output is cut back to where this file started.
+    Its profiler holds the Excel limit check (CSV/TSV) or, with stats set, the full
+    column statistics of the part.
+    With dedupe (a key field, or True for whole records), the part instead holds the
+    (digest, values) pairs of the rows, for Merge_dats to deduplicate and write.
+    """
+    result = {"path": path, "status": "ok", "headers": None, "rows": 0, "profiler": None, "error": ""}
+    if not os.path.isfile(path):
+        result["status"] = "missing"
+        return result
+
+    src_encoding = detect_encoding(path, os.path.basename(path))
+    if src_encoding in ['Error', 'No File']:
+        result["status"] = "encoding"
+        return result
+
+    sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
+    try:
+        records = read_dat_file_smart(path, src_encoding)
+        header_line = next(records)
+        headers = [strip_one_quote(h) for h in header_line.split(sep)]
+    except Exception as e:
+        result["status"] = "header"
+        result["error"] = str(e)
+        return result
+    result["headers"] = headers
+
+    field_count = len(headers)
+    append = callable(part_path)
+    if append:
+        part_path = part_path(headers)
+        start = os.path.getsize(part_path)
+    if fmt == "dat" and not stats and not dedupe and canonical_dat_start(path, src_encoding, field_count):
+        with timed_stage("write"), open(part_path, 'ab' if append else 'wb') as out:
+            rows = copy_dat_body(path, src_encoding, field_count, out, encoding)  # Transcoded to the merge encoding
+            if rows is None and append:
+                out.truncate(start)  # The rows are written again below
+        if rows is not None:
+            records.close()
+            result["rows"] = rows
+            return result
+    if PIPELINE:
+        records = pipelined(records)
+    if dedupe:
+        key_column = None
+        if dedupe is not True:
+            if dedupe not in headers:
+                result["status"] = "key"
+                return result
+            key_column = Schema(headers).index[dedupe]
+        salt = bytes.fromhex(header_group_hash(headers))[:16]  # Keys only match within a group
+
+        def keyed_rows():
+            for line in records:
+                if line.count(sep) != field_count - 1:
+                    result["status"] = "invalid"
+                    return
+                values = tuple(strip_one_quote(v) for v in line.split(sep))
+                result["rows"] += 1
+                yield dedupe_digest(values, key_column, salt), values
+
+        with timed_stage("write"):
+            write_batches(part_path, keyed_rows())
+        return result
+    profiler = ColumnProfiler(headers) if stats else None
+    with timed_stage("write"), RowWriter(headers, part_path, fmt, bomless_encoding(encoding), excel_check=fmt != "dat", write_header=False, profiler=profiler, append=append) as writer:
+        for line in records:
+            if line.count(sep) != field_count - 1:
+                result["status"] = "invalid"
+                break
+            if fmt == "dat" and is_canonical(line, sep, QUOTE_CHAR, field_count):
+                writer.write_record(line)  # Already canonical, copy the record body through
+                continue
+            writer.write_values(tuple(strip_one_quote(v) for v in line.split(sep)))
+    if append and result["status"] != "ok":
+        with open(part_path, 'r+b') as f:
+            f.truncate(start)
+    result["rows"] = writer.count
+    result["profiler"] = writer.profiler
+    return result
+
+
+def merge_file_part_task(task):
+    return merge_file_part(*task)
+
+
+def save_merge_checkpoint(checkpoint, grouped_files, excluded_files, done):
+    """Saves a merge whose first done manifest files are in the group outputs."""
+    outputs = {}
+    for group in grouped_files.values():
+        sync_file(group["path"])
+        outputs[group["path"]] = os.path.getsize(group["path"])
+    checkpoint.save({"outputs": outputs, "groups": grouped_files, "excluded": excluded_files, "done": done})
+
+
 def Merge_dats(merge_file, args):
     if not os.path.isfile(merge_file):
         print(f"❌ Merge list file not found: {merge_file}")
@@ -425,72 +3357,191 @@ def Merge_dats(merge_file, args):
         reader = csv.reader(f)
         all_paths = [row[0] for row in reader if row]
 
-    grouped_files = defaultdict(list)  # header_hash -> list of (filepath, headers, rows)
-    excluded_files = []
-
-    for path in all_paths:
-        if not os.path.isfile(path):
-            print(f"❌ File does not exist: {path}")
-            excluded_files.append(path)
-            continue
-
-        encoding = detect_encoding(path, os.path.basename(path))
-        if encoding in ['Error', 'No File']:
-            excluded_files.append(path)
-            continue
-        try:
-            line_iter = read_dat_file_smart(path, encoding)
-            header_line = next(line_iter)
-            headers = [strip_one_quote(h) for h in header_line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
-        except Exception as e:
-            print(f"❌ Failed to read headers from {path}: {e}")
-            excluded_files.append(path)
-            continue
-
-        if not file_has_valid_rows(path, headers, encoding):
-            print(f"⚠️ Invalid row structure detected, excluding file: {path}")
-            excluded_files.append(path)
-            continue
-        # Create a hash of the headers
-        header_hash = hashlib.sha256("||".join(headers).encode()).hexdigest()
-
-        # Collect rows
-        rows = []
-        for i, line in enumerate(read_dat_file_smart(path, encoding)):
-            if i == 0:
-                continue  # skip header
-            parsed = parse_line(line, headers)
-            if parsed:
-                rows.append(parsed)
-
-        grouped_files[header_hash].append((path, headers, rows))
-        
     m_EXPORT_ENCODING = 'utf-8-sig'  # Set default export encoding for merged files
     output_dir = args.output_dir or os.path.dirname(merge_file)
+    fmt = "dat"
+    if args.tsv:
+        fmt = "tsv"
+    elif args.csv:
+        fmt = "csv"
+
+    # With -j, every file is validated and written to its own part file by a worker, and
+    # parts are appended to their group's output in manifest order as soon as they are
+    # ready. Sequential merges write each file straight into its group's output.
+    grouped_files = OrderedDict()  # header_hash -> {"path", "headers", "files": [(path, row_count)], "profiler"}
+    excluded_files = []
+    stats = bool(args.column_stats)
+    # The checkpoint holds the groups and the number of manifest files merged into them
+    dedupe = getattr(args, "dedupe_key", None)
+    job = ("merge", file_signature(merge_file), os.path.abspath(output_dir or "."), fmt, stats)
+    checkpoint = None
+    if not dedupe:  # Dedupe digests are not saved
+        checkpoint = start_checkpoint(get_output_path(merge_file, "_merge", ".ckpt", output_dir), job, args)
+    # With dedupe, rows come back from the parts as values and the main process writes
+    # the first row of each key to the group output and the others to its duplicates file
+    deduper = Deduper(args.memory_budget) if dedupe else None
+    writers = {}  # header_hash -> (kept, duplicates) RowWriters, with dedupe
+    done = 0
+    if checkpoint is not None and checkpoint.state is not None:
+        state = checkpoint.state
+        for path, size in state["outputs"].items():
+            with open(path, 'r+b') as f:
+                f.truncate(size)  # Drop a part that was being appended after the checkpoint
+        grouped_files, excluded_files, done = state["groups"], state["excluded"], state["done"]
+        print(f"⏩ Skipping the first {done} of {len(all_paths)} files, already merged.")
+
+    if checkpoint is not None:
+        # Named after the checkpoint, so parts left by an interrupted run are cleared on the next one
+        part_dir = os.path.splitext(checkpoint.path)[0] + "_parts"
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+    else:
+        part_dir = tempfile.mkdtemp(prefix="merge_parts_", dir=output_dir or None)
+
+    def group_for(headers):
+        """The group of files with these headers, created with its output on first use."""
+        header_hash = header_group_hash(headers)
+        group = grouped_files.get(header_hash)
+        if group is None:
+            idx = len(grouped_files) + 1
+            group = {"path": get_output_path(merge_file, f"_group_{idx}", "." + fmt, output_dir),
+                     "headers": headers, "files": [], "profiler": None}
+            grouped_files[header_hash] = group
+            if deduper is None:
+                RowWriter(headers, group["path"], fmt, m_EXPORT_ENCODING).close()  # Header only
+            else:
+                group["duplicates"] = []  # Per file
+                writers[header_hash] = (
+                    RowWriter(headers, group["path"], fmt, m_EXPORT_ENCODING, excel_check=fmt != "dat",
+                              profiler=ColumnProfiler(headers) if stats else None),
+                    RowWriter(headers, get_output_path(merge_file, f"_group_{idx}_duplicates", "." + fmt, output_dir),
+                              fmt, m_EXPORT_ENCODING, excel_check=fmt != "dat"))
+        return group
+
+    direct = args.jobs <= 1 and deduper is None  # Dedupe parts hold digests, decided once the whole file is valid
+    tasks = [(path, fmt, m_EXPORT_ENCODING, (lambda headers: group_for(headers)["path"]) if direct else os.path.join(part_dir, f"{i}.part"),
+              stats, dedupe) for i, path in enumerate(all_paths)][done:]
+    executor = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+
+    def bounded_results():
+        """Part results in manifest order, with only a few parts written ahead of the one being appended."""
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(merge_file_part_task, task))
+            if len(pending) >= args.jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    try:
+        results = bounded_results() if executor else map(merge_file_part_task, tasks)
+        for done, ((path, _, _, part_path, _, _), result) in enumerate(zip(tasks, results), done + 1):
+            status = result["status"]
+            if status != "ok":
+                if status == "missing":
+                    print(f"❌ File does not exist: {path}")
+                elif status == "header":
+                    print(f"❌ Failed to read headers from {path}: {result['error']}")
+                elif status == "invalid":
+                    print(f"⚠️ Invalid row structure detected, excluding file: {path}")
+                elif status == "key":
+                    print(f"⚠️ Dedupe key '{dedupe}' is not in the headers, excluding file: {path}")
+                excluded_files.append(path)
+                if direct:
+                    header_hash = header_group_hash(result["headers"]) if result["headers"] else None
+                    group = grouped_files.get(header_hash)
+                    if group is not None and not group["files"]:
+                        del grouped_files[header_hash]  # Created for this file only
+                        os.remove(group["path"])
+                elif os.path.exists(part_path):
+                    os.remove(part_path)
+                continue
+
+            headers = result["headers"]
+            # Create a hash of the headers
+            header_hash = header_group_hash(headers)
+            group = group_for(headers)
+
+            if result["profiler"] is not None:
+                if group["profiler"] is None:
+                    group["profiler"] = ColumnProfiler(headers, distinct=stats)
+                group["profiler"].merge(result["profiler"])  # Parts arrive in manifest order
+            group["files"].append((path, result["rows"]))
+            if deduper is not None:
+                group["duplicates"].append(0)
+                file_no = len(group["files"]) - 1
+                kept, duplicates = writers[header_hash]
+                with timed_stage("write"):
+                    for digest, values in read_batches(part_path):
+                        duplicate = deduper.push(digest, (header_hash, file_no, values))
+                        if duplicate:
+                            duplicates.write_values(values)
+                            group["duplicates"][file_no] += 1
+                        elif duplicate is not None:
+                            kept.write_values(values)
+            elif not direct:
+                with open(part_path, 'rb') as src, open(group["path"], 'ab') as dst:
+                    shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+            if not direct:
+                os.remove(part_path)
+            # Only once the file is in its group output, which sequential merges write while producing result
+            if checkpoint is not None and checkpoint.due():
+                save_merge_checkpoint(checkpoint, grouped_files, excluded_files, done)
+        if deduper is not None:
+            with timed_stage("write"):
+                for duplicate, (header_hash, file_no, values) in deduper.finish():  # Rows decided after spilling
+                    kept, duplicates = writers[header_hash]
+                    if duplicate:
+                        duplicates.write_values(values)
+                        grouped_files[header_hash]["duplicates"][file_no] += 1
+                    else:
+                        kept.write_values(values)
+    finally:
+        if executor:
+            executor.shutdown()
+        shutil.rmtree(part_dir, ignore_errors=True)
+        if deduper is not None:
+            deduper.close()
+        for kept, duplicates in writers.values():
+            kept.close()
+            duplicates.close()
+    if checkpoint is not None:
+        checkpoint.remove()
 
     group_log = [] # List to keep track of merged groups and files
 
-    # Export merged groups
-    for idx, (header_hash, files_info) in enumerate(grouped_files.items(), 1):
-        all_headers = files_info[0][1]
-        all_rows = []
-        for path, headers, rows in files_info:
-            all_rows.extend(rows)
-            group_log.append({"Group": f"merged_group_{idx}", "File": path,"RowCount": len(rows)})
-        
-        fmt = "dat"
-        if args.tsv:
-            fmt = "tsv"
-        elif args.csv:
-            fmt = "csv"
-        # Create output path for merged group
-        output_base = get_output_path(merge_file, f"_group_{idx}", "."+fmt, output_dir)
-        print(f"✅ Merging group {idx} with {len(files_info)} files ({len(all_rows)} total rows)")
-        export_data(all_headers, all_rows, output_base, fmt=fmt, encoding=m_EXPORT_ENCODING)
+    for idx, (header_hash, group) in enumerate(grouped_files.items(), 1):
+        total_rows = 0
+        for file_no, (path, row_count) in enumerate(group["files"]):
+            total_rows += row_count
+            entry = (f"merged_group_{idx}", path, str(row_count))
+            if deduper is not None:
+                entry += (str(group["duplicates"][file_no]),)
+            group_log.append(entry)
+        print(f"✅ Merging group {idx} with {len(group['files'])} files ({total_rows} total rows)")
+        if deduper is not None:
+            kept, duplicates = writers[header_hash]
+            group["profiler"] = kept.profiler
+            total_rows = kept.count
+        profiler = group["profiler"]
+        if profiler is not None:
+            profiler.print_excel_summary()
+        print(f"Exported {total_rows} rows to {group['path']}")
+        if deduper is not None:
+            if fmt != "dat":
+                duplicates.profiler.print_excel_summary()
+            print(f"🧹 Moved {duplicates.count} duplicate rows to {duplicates.output_path}")
+        if stats:
+            json_path = None
+            if isinstance(args.column_stats, str):
+                root, ext = os.path.splitext(args.column_stats)
+                json_path = f"{root}_group_{idx}{ext or '.json'}"
+            report_column_stats(profiler, json_path)
 
     # Write log CSV
     log_path = get_output_path(merge_file, "_merge_log", ".csv", output_dir)
-    export_data(["Group", "File", "RowCount"], group_log, log_path, fmt="csv", encoding="utf-8-sig")
+    log_headers = ["Group", "File", "RowCount"] + (["Duplicates"] if deduper is not None else [])
+    export_data(log_headers, group_log, log_path, fmt="csv", encoding="utf-8-sig")
     print(f"📝 Merge log written to {log_path}")
 
     if excluded_files:
@@ -500,115 +3551,683 @@ def Merge_dats(merge_file, args):
 
 # === Delete Rows ===
 def delete_rows(input_file, delete_file, args):
+    """
+    Splits input_file into {kept} and {removed} outputs by the values listed in
+    delete_file and/or the --where expression in args.where (a row is removed when it
+    matches both). Returns the number of rows written, or None if nothing was written.
+    """
     input_name = os.path.splitext(os.path.basename(input_file))[0]
     input_dir = os.path.dirname(input_file)
     
     # Detect input encoding
     d_Export_ENCODING = detect_encoding(input_file, os.path.basename(input_file))  # Default export encoding for deleted rows
     
-    # Load delete values
-    delete_encoding = detect_encoding(delete_file, os.path.basename(delete_file))
-    with open(delete_file, encoding=delete_encoding) as f:
-        lines = [line.strip() for line in f if line.strip()]
-        if not lines:
-            print("❌ Deletion file List is empty.")
-            return
-        field = lines[0]
-        delete_values_list = lines[1:]
-        delete_values_set = set(delete_values_list)
+    where_text = getattr(args, "where", None)
+    try:
+        where = parse_where(where_text) if where_text else None
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
 
-    print(f"🧹 Will delete rows where '{field}' has one of the values: {', '.join(delete_values_list)}")
+    field = None
+    delete_values_set = set()
+    if isinstance(delete_file, str):
+        # Load delete values
+        delete_encoding = detect_encoding(delete_file, os.path.basename(delete_file))
+        with open(delete_file, encoding=delete_encoding) as f:
+            lines = [line.strip() for line in f if line.strip()]
+            if not lines:
+                print("❌ Deletion file List is empty.")
+                return
+            field = lines[0]
+            delete_values_list = lines[1:]
+            delete_values_set = set(delete_values_list)
+
+        shown_values = ', '.join(delete_values_list[:20])
+        if len(delete_values_list) > 20:
+            shown_values += f", ... ({len(delete_values_list)} values)"
+        print(f"🧹 Will delete rows where '{field}' has one of the values: {shown_values}")
+    elif where is None:
+        print("❌ Please provide a deletion file or a --where expression for --delete.")
+        return
+    if where is not None:
+        print(f"🧹 Will delete rows {'that also match' if field else 'matching'}: {where_text}")
 
-    # Read headers
-    line_iter = read_dat_file_smart(input_file, d_Export_ENCODING)
-    header_line = next(line_iter)
-    headers = [strip_one_quote(h) for h in header_line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
+    schema, records = iter_record_values(input_file, d_Export_ENCODING, args.jobs, report_mismatch=False, lazy=True)
+    headers = schema.headers
 
-    if field not in headers:
+    if field is not None and field not in schema.index:
         print(f"❌ Field '{field}' not found in input file headers: {headers}")
         return
-
-    if not file_has_valid_rows(input_file, headers, d_Export_ENCODING):
-        print(f"❌ Input file has invalid rows. Aborting delete operation.")
+    try:
+        predicate = compile_where(where, schema) if where is not None else None
+    except ValueError as e:
+        print(f"❌ {e}")
         return
 
-    # Gather all values present in the DAT file for the target field
-    present_values = set()
-    all_rows = []
-    for i, line in enumerate(read_dat_file_smart(input_file, d_Export_ENCODING)):
-        if i == 0:
-            continue
-        parsed = parse_line(line, headers)
-        if parsed:
-            present_values.add(parsed.get(field, ""))
-            all_rows.append(parsed)
+    fmt = "dat"
+    if args.tsv:
+        fmt = "tsv"
+    elif args.csv:
+        fmt = "csv"
+
+    kept_path = get_output_path(input_file, "{kept}", "." + fmt, args.output_dir)
+    removed_path = get_output_path(input_file, "{removed}", "." + fmt, args.output_dir)
+
+    # Single pass: every record goes straight to the kept or removed writer. Outputs are
+    # written to temporary files and only put in place once the whole input proved valid.
+    field_idx = schema.index[field] if field is not None else None
+    matched_values = set()
+    invalid_rows = []
+    profiler = ColumnProfiler(headers) if args.column_stats else None  # Statistics of the input rows
+    excel_check = fmt != "dat"
+    kept = RowWriter(headers, kept_path + ".part", fmt, d_Export_ENCODING, excel_check)
+    removed = RowWriter(headers, removed_path + ".part", fmt, d_Export_ENCODING, excel_check)
+    try:
+        with timed_stage("write"):
+            for row_num, values in enumerate(records, 2):
+                if values is None:
+                    invalid_rows.append(row_num)
+                    continue
+                if invalid_rows:
+                    continue  # Output is discarded anyway, only keep counting invalid rows
+                if profiler is not None:
+                    values = values.values() if type(values) is LazyRecord else values  # Decoded once for both
+                    profiler.add(values)
+                remove = True
+                if field_idx is not None:
+                    value = values[field_idx]
+                    remove = value in delete_values_set
+                    if remove:
+                        matched_values.add(value)
+                if remove and predicate is not None:
+                    remove = predicate(values)
+                if remove:
+                    removed.write_values(values)
+                else:
+                    kept.write_values(values)
+    finally:
+        kept.close()
+        removed.close()
+
+    if invalid_rows:
+        os.remove(kept.output_path)
+        os.remove(removed.output_path)
+        shown = ', '.join(str(n) for n in invalid_rows[:10])
+        print(f"❌ Input file has {len(invalid_rows)} invalid row(s) (row {shown}{', ...' if len(invalid_rows) > 10 else ''}). Aborting delete operation.")
+        return
 
     # Check for missing delete values
-    missing_values = delete_values_set - present_values
+    missing_values = delete_values_set - matched_values
     if missing_values:
         print(f"⚠️ The following value(s) for '{field}' were not found in the DAT file: {', '.join(missing_values)}")
 
-    # Filter rows
-    kept_rows = []
-    deleted_rows = []
-    for i, line in enumerate(read_dat_file_smart(input_file, d_Export_ENCODING)):
-        if i == 0:
-            continue
-        parsed = parse_line(line, headers)
-        if parsed:
-            if parsed.get(field) in delete_values_set:
-                deleted_rows.append(parsed)
+    os.replace(kept.output_path, kept_path)
+    os.replace(removed.output_path, removed_path)
+    for writer, path in ((kept, kept_path), (removed, removed_path)):
+        if excel_check:
+            writer.profiler.print_excel_summary()
+        print(f"Exported {writer.count} rows to {path}")
+    print(f"✅ Done. Kept {kept.count} rows, removed {removed.count} rows.")
+    report_column_stats(profiler, args.column_stats)
+    return kept.count + removed.count
+
+
+# === Selected Header ===
+def select_fields_stream(input_file_path, selected_headers, encoding, jobs=1, where=None, checkpoint=None):
+    """
+    Reads a DAT file and returns only the specified selected headers with a generator
+    of the corresponding row data.
+    where is an optional parse_where tree; only matching rows are returned.
+    checkpoint is passed on to iter_record_values.
+    """
+    wanted = set(selected_headers)
+    extra = where_fields(where) - wanted if where is not None else set()
+    prefilter = where_literals(where) if where is not None else None
+    # Only the selected columns (and those the filter needs) are extracted by the parser
+    schema, records = iter_record_values(input_file_path, encoding, jobs, lazy=True, select=wanted | extra, prefilter=prefilter, checkpoint=checkpoint)
+    predicate = compile_where(where, schema) if where is not None else None
+    rows = filter_rows(records, predicate)
+    if extra:
+        columns = [i for i, h in enumerate(schema.headers) if h in wanted]
+        schema = Schema(schema.headers[i] for i in columns)
+        rows = (pick_columns(values, columns) for values in rows)
+    return schema.headers, rows
+
+
+# === Sort ===
+SORT_COLLATIONS = ("natural", "bates", "text")
+SORT_MERGE_WIDTH = 128  # Runs merged at once; more runs are merged in several passes
+DIGIT_RUNS = re.compile(r'(\d+)')
+DATE_SHAPE = re.compile(r'\s*\d{1,4}[-/]\d{1,2}[-/]\d{1,4}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?\s*$')
+BATES_NUMBER = re.compile(r'(\D*)(\d+)(.*)$', re.S)
+
+
+def natural_key(value):
+    """
+    Collation key that compares runs of digits as numbers and text without regard to
+    case, so DOC2 sorts before DOC10. Dates in one of DATE_FORMATS sort by date,
+    before other values; empty values sort first.
+    """
+    if not value.strip():
+        return (0,)
+    if DATE_SHAPE.match(value):
+        day = parse_date(value)
+        if day is not None:
+            return (1, day.toordinal(), value)
+    parts = DIGIT_RUNS.split(value.casefold())
+    parts[1::2] = map(int, parts[1::2])
+    return (2, parts)
+
+
+def bates_key(value):
+    """
+    Collation key for Bates numbers: the prefix without regard to case, then the
+    number, then any suffix (such as an attachment range) naturally.
+    """
+    match = BATES_NUMBER.match(value.strip())
+    if match is None:
+        return (value.strip().casefold(), -1, [])
+    prefix, number, rest = match.groups()
+    parts = DIGIT_RUNS.split(rest.casefold())
+    parts[1::2] = map(int, parts[1::2])
+    return (prefix.casefold(), int(number), parts)
+
+
+def sort_key(columns, collation="natural"):
+    """Returns a function giving the collation key of a row on the given columns."""
+    collate = {"natural": natural_key, "bates": bates_key, "text": str}[collation]
+    if len(columns) == 1:
+        column, = columns
+        return lambda values: collate(values[column])
+    return lambda values: tuple([collate(values[c]) for c in columns])
+
+
+@contextmanager
+def gc_paused():
+    """
+    Turns off the cyclic garbage collector for a block. Rows have no reference cycles,
+    and while a run is collected the collector would rescan every row held so far.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def sorted_runs(rows, key, budget_bytes, run_dir, name, keep_last=False):
+    """
+    Sorts rows in runs that fit in budget_bytes (estimated from the value lengths) and
+    writes each run to a file in run_dir as (key, row) pairs, with LazyRecords reduced
+    to their raw fields. Returns the runs in input order, as file paths or with
+    keep_last, a list of pairs for the last run if it was not written, and the codec of
+    the LazyRecords (None for value tuples). The sort is stable, so rows with equal keys
+    keep their input order.
+    """
+    runs = []
+    pairs = []
+    used = 0
+    row_bytes = None
+    codec = None
+    with gc_paused():
+        for values in rows:
+            if row_bytes is None:
+                row_bytes = 200 + 60 * len(values)  # Row, key and per-value object overhead
+            k = key(values)
+            if type(values) is LazyRecord:
+                codec = values.codec
+                values = values.fields  # Pickled much faster than the record
+            used += row_bytes + sum(map(len, values))
+            pairs.append((k, values))
+            if used > budget_bytes:
+                runs.append(spill_sorted_run(pairs, run_dir, f"{name}_{len(runs)}"))
+                pairs = []
+                used = 0
+    if pairs or not runs:
+        if keep_last:
+            with timed_stage("sort"):
+                pairs.sort(key=operator.itemgetter(0))
+            runs.append(pairs)
+        else:
+            runs.append(spill_sorted_run(pairs, run_dir, f"{name}_{len(runs)}"))
+    return runs, codec
+
+
+def spill_sorted_run(pairs, run_dir, name):
+    with timed_stage("sort"):
+        pairs.sort(key=operator.itemgetter(0))
+        path = os.path.join(run_dir, name)
+        write_batches(path, pairs)
+    return path
+
+
+def sort_range_task(task):
+    """Worker: parses one byte range and writes its rows matching where as sorted runs."""
+    file_path, codec, start, end, headers, columns, collation, where, budget_bytes, run_dir, part = task
+    predicate = compile_where(where, Schema(headers)) if where is not None else None
+    records = parse_range_task((file_path, codec, start, end, len(headers), True, None))
+    return sorted_runs(filter_rows(records, predicate), sort_key(columns, collation), budget_bytes, run_dir, f"part{part}")[0]
+
+
+def merge_sorted_runs(runs, run_dir):
+    """
+    k-way merges sorted runs (paths or lists of pairs) into one stream of (key, row)
+    pairs with heapq.merge. Equal keys come from the earlier run first, which keeps
+    the sort stable. Runs beyond SORT_MERGE_WIDTH are first merged into larger run files.
+    """
+    level = 0
+    while len(runs) > SORT_MERGE_WIDTH:
+        merged = []
+        for i in range(0, len(runs), SORT_MERGE_WIDTH):
+            group = runs[i:i + SORT_MERGE_WIDTH]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            path = os.path.join(run_dir, f"merge{level}_{i}")
+            with timed_stage("sort"):
+                write_batches(path, merge_sorted_runs(group, run_dir))
+            for run in group:
+                if isinstance(run, str):
+                    os.remove(run)
+            merged.append(path)
+        runs = merged
+        level += 1
+    return merge(*(read_batches(run) if isinstance(run, str) else run for run in runs), key=operator.itemgetter(0))
+
+
+def read_dat_schema(file_path, encoding):
+    """The Schema of a DAT file's header record."""
+    records = read_dat_file_smart(file_path, encoding)
+    header_line = next(records, None)
+    records.close()
+    if header_line is None:
+        return Schema([])
+    return Schema(strip_one_quote(h) for h in header_line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR))
+
+
+def sort_stream(input_file_path, sort_fields, encoding, collation="natural", memory_budget=DEFAULT_MEMORY_BUDGET_MB, jobs=1, where=None):
+    """
+    Reads a DAT file and returns its headers with a generator of its rows ordered by
+    sort_fields (header names), compared with the given collation (natural, bates or
+    text). Rows are sorted in memory while they fit in memory_budget (MB); beyond it
+    they are written to temp files as sorted runs and merged back with heapq.merge,
+    so inputs larger than memory can be sorted.
+    With jobs > 1, worker processes parse byte ranges of the file and sort their runs.
+    where is an optional parse_where tree; only matching rows are returned.
+    Raises ValueError if a sort field is not in the header.
+    """
+    ranges = None
+    if jobs > 1 and not CACHE:
+        ranges = split_body_ranges(input_file_path, encoding, jobs)
+        if not ranges:
+            print("ℹ️ Input is too small or irregular to split, sorting sequentially.")
+    if ranges:
+        schema = read_dat_schema(input_file_path, encoding)
+        records = None
+    else:
+        prefilter = where_literals(where) if where is not None else None
+        schema, records = iter_record_values(input_file_path, encoding, lazy=True, prefilter=prefilter)
+    missing = [name for name in sort_fields if name not in schema.index]
+    if missing:
+        if records is not None:
+            records.close()
+        raise ValueError(f"Sort field(s) not in the header: {', '.join(missing)}")
+    columns = [schema.index[name] for name in sort_fields]
+    predicate = compile_where(where, schema) if where is not None else None  # Fails early on unknown where fields
+    budget_bytes = memory_budget * 1024 * 1024
+
+    def sorted_rows():
+        with tempfile.TemporaryDirectory(prefix="sort_") as run_dir:
+            if ranges:
+                codec, spans = ranges
+                tasks = [(input_file_path, codec, start, end, schema.headers, columns, collation, where,
+                          budget_bytes // jobs, run_dir, part) for part, (start, end) in enumerate(spans)]
+                with ProcessPoolExecutor(jobs) as executor:
+                    runs = [run for part_runs in executor.map(sort_range_task, tasks) for run in part_runs]
+                codec = None
+            else:
+                runs, codec = sorted_runs(filter_rows(records, predicate), sort_key(columns, collation), budget_bytes, run_dir, "run", keep_last=True)
+                if len(runs) > 1:
+                    print(f"ℹ️ Sort exceeds {memory_budget} MB, merging {len(runs)} sorted runs from temp files.")
+            for _, values in merge_sorted_runs(runs, run_dir):
+                yield LazyRecord(values, codec) if codec else values
+
+    return schema.headers, sorted_rows()
+
+
+# === Join Overlay ===
+JOIN_TYPES = ("left", "inner")
+
+
+def join_stream(input_file_path, overlay_path, key, encoding, header_map=None, how="left", memory_budget=DEFAULT_MEMORY_BUDGET_MB, jobs=1, where=None):
+    """
+    Reads a DAT file and returns its headers, extended with the fields of an overlay DAT
+    file, with a generator of the combined rows matched on the key field.
+    header_map ({overlay header: new header}, see load_mapping_file) renames overlay
+    headers, and when given only the overlay fields it names are added; the key is
+    named as in the input. Overlay fields that are already in the input replace its
+    values on matched rows. With how="left" unmatched rows are kept with empty overlay
+    fields, with "inner" they are dropped. The first overlay row of each key is used.
+    The overlay is always the indexed side, whatever the file sizes, and rows come out
+    in input order; beyond memory_budget (MB) the index is hash partitioned to temp files.
+    where is an optional parse_where tree over the combined headers.
+    Raises ValueError if the key is not in both files.
+    """
+    overlay_encoding = detect_encoding(overlay_path, os.path.basename(overlay_path))
+    if overlay_encoding in ('Error', 'No File'):
+        raise ValueError(f"Cannot read the overlay file {overlay_path}")
+    overlay_schema = read_dat_schema(overlay_path, overlay_encoding)
+    renamed = overlay_schema.rename(header_map or {})
+    if key not in renamed.index:
+        raise ValueError(f"Join key '{key}' is not in the overlay headers: {', '.join(renamed.headers)}")
+    overlay_key = renamed.index[key]
+    added = {name: i for i, name in enumerate(renamed.headers)
+             if name != key and (not header_map or overlay_schema.headers[i] in header_map)}  # Last one wins for repeated names
+    if not added:
+        raise ValueError("The overlay has no fields to add besides the key.")
+
+    schema = read_dat_schema(input_file_path, encoding)
+    if key not in schema.index:
+        raise ValueError(f"Join key '{key}' is not in the headers: {', '.join(schema.headers)}")
+    key_idx = schema.index[key]
+    replaced = [name for name in added if name in schema.index]
+    new_headers = schema.headers + [name for name in added if name not in schema.index]
+    targets = [schema.index.get(name, new_headers.index(name)) for name in added]
+    columns = list(added.values())
+    blanks = [""] * (len(new_headers) - len(schema))
+    predicate = compile_where(where, Schema(new_headers)) if where is not None else None  # Fails early on unknown where fields
+    if replaced:
+        print(f"ℹ️ Overlay values replace the input's on matched rows for: {', '.join(replaced)}")
+
+    def overlay_pairs():
+        for values in iter_record_values(overlay_path, overlay_encoding)[1]:
+            if values is not None and values[overlay_key]:  # Empty keys match nothing
+                yield values[overlay_key], tuple([values[c] for c in columns])
+
+    def input_pairs():
+        for values in iter_record_values(input_file_path, encoding, jobs)[1]:
+            if values is not None:
+                yield values[key_idx], values
+
+    def joined_rows():
+        counts = {"matched": 0, "unmatched": 0, "repeated": 0}
+        for _, overlay_values, values in join_by_key(overlay_pairs, input_pairs, memory_budget, os.path.getsize(overlay_path), outer=False):
+            if values is None:
+                counts["repeated"] += 1
+                continue
+            row = list(values)
+            row += blanks
+            if overlay_values is None:
+                counts["unmatched"] += 1
+                if how == "inner":
+                    continue
             else:
-                kept_rows.append(parsed)
+                counts["matched"] += 1
+                for target, value in zip(targets, overlay_values):
+                    row[target] = value
+            if predicate is None or predicate(row):
+                yield row
+        print(f"🔗 Joined on '{key}': {counts['matched']} row(s) matched, {counts['unmatched']} "
+              f"{'kept without overlay values' if how == 'left' else 'dropped'}.")
+        if counts["repeated"]:
+            print(f"⚠️ {counts['repeated']} overlay row(s) repeat an earlier key and were ignored.")
+
+    return new_headers, instrument(joined_rows(), "join")
+
+
+# === Single File Operations ===
+OPERATION_SUFFIXES = {"convert": "_converted", "replace-header": "_Replaced", "select": "_selected", "sort": "_sorted", "join": "_joined"}
+
+
+def output_format(args):
     fmt = "dat"
     if args.tsv:
         fmt = "tsv"
     elif args.csv:
         fmt = "csv"
+    return fmt
 
-    kept_path = get_output_path(input_file, "{kept}", "." + fmt, args.output_dir)
-    removed_path = get_output_path(input_file, "{removed}", "." + fmt, args.output_dir)
 
-    export_data(headers, kept_rows, kept_path, fmt=fmt, encoding=d_Export_ENCODING)
-    export_data(headers, deleted_rows, removed_path, fmt=fmt, encoding=d_Export_ENCODING)
-    print(f"✅ Done. Kept {len(kept_rows)} rows, removed {len(deleted_rows)} rows.")
+def parse_sort_fields(text):
+    """Splits 'FIELD[,FIELD...]' into field names."""
+    return [name.strip() for name in text.split(",") if name.strip()]
 
 
-# === Selected Header ===
-def select_fields_and_collect(input_file_path, selected_headers, encoding):
+def read_selected_headers(select_file):
+    with open(select_file, encoding=detect_encoding(select_file, os.path.basename(select_file))) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_operation(operation, args, output_path=None):
     """
-    Reads a DAT file and returns only the specified selected headers and corresponding row data.
+    Runs convert, replace-header, select, sort, join or delete on args.input_file, with
+    the list file of the operation in args.replace_header, args.select or args.delete
+    (the comma separated sort fields in args.sort, compared with args.collation; the
+    overlay file in args.join, matched on args.on with args.join_type and renamed
+    through the args.mapping file) and an optional --where filter in args.where.
+    With args.dedupe_key (a field of the output, or True for whole records), only the
+    first row of each key is written and the others go to a _duplicates file.
+    Convert, replace-header and select save a checkpoint next to the output every
+    args.checkpoint_interval seconds, and continue from it with args.resume (not when
+    deduplicating).
+    output_path defaults to the input name with the operation's suffix (delete always
+    writes {kept} and {removed} files to args.output_dir).
+    Returns the number of rows written, or None if the operation failed.
     """
-    new_headers = []
-    rows = []
+    if operation == "delete":
+        return delete_rows(args.input_file, args.delete, args)
+
+    Encode = detect_encoding(args.input_file, os.path.basename(args.input_file))
+    if Encode in ('Error', 'No File'):
+        return None
+    fmt = output_format(args)
+    if output_path is None:
+        output_path = get_output_path(args.input_file, OPERATION_SUFFIXES[operation], "." + fmt, args.output_dir)
+    jobs = args.jobs
+    dedupe = getattr(args, "dedupe_key", None)
+    try:
+        where = parse_where(args.where) if args.where else None
+        if operation == "select":
+            selected_headers = read_selected_headers(args.select)
+            if not selected_headers:
+                print("❌ No headers selected in the selection file.")
+                return None
+            columns = selected_headers
+        elif operation == "sort":
+            sort_fields = parse_sort_fields(args.sort)
+            if not sort_fields:
+                print("❌ No sort fields given.")
+                return None
+            columns = sort_fields + [args.collation]
+        elif operation == "join":
+            header_map = get_mapping_dict(args.mapping) if args.mapping else None
+            columns = [args.join, args.on, args.join_type]
+        else:
+            header_map = get_mapping_dict(args.replace_header) if operation == "replace-header" else {}
+            columns = sorted(header_map.items())
+        if (operation in ("convert", "replace-header") and fmt == "dat" and not (where or dedupe or args.column_stats)
+                and not args.resume and not BUILD_INDEX):
+            schema = read_dat_schema(args.input_file, Encode)
+            if schema.headers:
+                rows = passthrough_dat(args.input_file, Encode, schema.rename(header_map).headers, output_path)
+                if rows is not None:
+                    return rows
+                print("ℹ️ Records are not all in canonical DAT form, parsing them one by one.")
+        job = (operation, file_signature(args.input_file), os.path.abspath(output_path), fmt, Encode, args.where, columns,
+               bool(args.column_stats))
+        checkpoint = None
+        if operation not in ("sort", "join") and not dedupe:  # Sorted and spilled joins reorder rows, and dedupe digests are not saved
+            checkpoint = start_checkpoint(output_path + ".ckpt", job, args)
+        if checkpoint is not None and (jobs > 1 or PIPELINE):
+            if checkpoint.state is None:
+                checkpoint = None  # Parallel or pipelined parsing reads ahead, so there is no position to save
+            else:
+                print("ℹ️ Resumed runs are parsed sequentially.")
+                jobs = 1
+        if operation == "select":
+            new_headers, rows = select_fields_stream(args.input_file, selected_headers, Encode, jobs, where, checkpoint)
+        elif operation == "sort":
+            new_headers, rows = sort_stream(args.input_file, sort_fields, Encode, args.collation, args.memory_budget, jobs, where)
+        elif operation == "join":
+            new_headers, rows = join_stream(args.input_file, args.join, args.on, Encode, header_map, args.join_type, args.memory_budget, jobs, where)
+        else:
+            new_headers, rows = replace_header_stream(args.input_file, header_map, Encode, jobs, where, checkpoint) # Rows stream straight into the writer
+        key_column = None
+        if dedupe not in (None, True):
+            if dedupe not in new_headers:
+                raise ValueError(f"Dedupe key '{dedupe}' is not in the headers: {', '.join(new_headers)}")
+            key_column = Schema(new_headers).index[dedupe]
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None
+
+    duplicates = None
+    if dedupe:
+        root, ext = os.path.splitext(output_path)
+        duplicates = RowWriter(new_headers, root + "_duplicates" + ext, fmt, Encode, excel_check=fmt != "dat")
+        rows = dedupe_rows(rows, key_column, duplicates, args.memory_budget)
+    stats = ColumnProfiler(new_headers) if args.column_stats else None
+    try:
+        count = export_data(new_headers, rows, output_path, fmt=fmt, encoding=Encode, stats=stats, checkpoint=checkpoint)
+    finally:
+        if duplicates is not None:
+            duplicates.close()
+    if duplicates is not None:
+        if fmt != "dat":
+            duplicates.profiler.print_excel_summary()
+        print(f"🧹 Moved {duplicates.count} duplicate rows to {duplicates.output_path}")
+    report_column_stats(stats, args.column_stats)
+    if checkpoint is not None:
+        checkpoint.remove()
+    return count
 
-    for i, line in enumerate(read_dat_file_smart(input_file_path, encoding)):
-        if i == 0:
-            # Parse headers from first line
-            headers = [strip_one_quote(h) for h in line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)]
-            # Filter headers based on selection
-            new_headers = [h for h in headers if h in selected_headers]
+
+# === Batch Jobs ===
+BATCH_OPERATIONS = ("convert", "replace-header", "select", "sort", "delete")
+
+
+def load_batch_manifest(manifest_path):
+    """
+    Reads a job manifest: a JSON list of objects, or a CSV file with a header line.
+    Each job has an operation, an input and optionally an output, a format
+    (csv/tsv/dat), a file (the mapping, select or delete list of the operation), a
+    where expression and, for sort, the sort fields and a collation.
+    """
+    with open(manifest_path, encoding=detect_encoding(manifest_path, os.path.basename(manifest_path))) as f:
+        if manifest_path.lower().endswith(".json"):
+            jobs = json.load(f)
         else:
-            parsed_row = parse_line(line, headers)
-            if parsed_row:
-                # Select only the desired fields
-                filtered_row = {key: value for key, value in parsed_row.items() if key in selected_headers}
-                rows.append(filtered_row)
+            jobs = list(csv.DictReader(f))
+    return [{str(k).strip().lower(): (str(v).strip() if v is not None else "") for k, v in job.items() if k is not None}
+            for job in jobs]
 
-    return new_headers, rows
 
+def parse_shard(shard):
+    """Parses '--shard i/N' into (i, N), with 1 <= i <= N. Returns None if malformed."""
+    try:
+        i, n = (int(part) for part in shard.split("/"))
+    except ValueError:
+        return None
+    return (i, n) if 1 <= i <= n else None
 
-    # === Utility Functions ===
 
-def file_has_valid_rows(file_path, headers, encoding):
-    for i, line in enumerate(read_dat_file_smart(file_path, encoding)):
-        if i == 0:
-            continue
-        values = line.split(QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR)
-        values = [strip_one_quote(value) for value in values]
-        if len(values) != len(headers):
-            return False
-    return True
+def run_batch_job(task):
+    """
+    Runs one manifest job in a worker process and returns its results log entry.
+    The job's output is a file path, or a directory for delete.
+    """
+    job_no, job, output_dir, column_stats, sample, build_index, pipeline, cache, cache_dir, checkpoint_interval, resume, memory_budget = task
+    global ENCODING_SAMPLE_BYTES, BUILD_INDEX, PIPELINE, CACHE, CACHE_DIR
+    # Not inherited by spawned workers
+    ENCODING_SAMPLE_BYTES, BUILD_INDEX, PIPELINE, CACHE, CACHE_DIR = sample, build_index, pipeline, cache, cache_dir
+    operation = job.get("operation", "").lower()
+    fmt = job.get("format", "").lower() or "dat"
+    output = job.get("output") or None
+    result = {"job": job_no, "operation": operation, "input": job.get("input", ""), "output": output or "",
+              "status": "ok", "rows": 0, "seconds": 0.0, "error": ""}
+    if operation not in BATCH_OPERATIONS or fmt not in ("csv", "tsv", "dat") or not result["input"]:
+        result["status"] = "invalid"
+        result["error"] = f"needs an operation ({', '.join(BATCH_OPERATIONS)}), an input and a format (csv, tsv, dat)"
+        return result
+    collation = job.get("collation", "").lower() or "natural"
+    if operation == "sort" and (not job.get("sort") or collation not in SORT_COLLATIONS):
+        result["status"] = "invalid"
+        result["error"] = f"sort needs sort fields and a collation ({', '.join(SORT_COLLATIONS)})"
+        return result
+    if operation not in ("convert", "sort") and not job.get("file") and not (operation == "delete" and job.get("where")):
+        result["status"] = "invalid"
+        result["error"] = f"{operation} needs a file" + (" or a where expression" if operation == "delete" else "")
+        return result
+
+    list_file = job.get("file") or None
+    args = argparse.Namespace(input_file=result["input"], csv=fmt == "csv", tsv=fmt == "tsv", dat=fmt == "dat",
+                              replace_header=list_file, select=list_file, delete=list_file,
+                              output_dir=(output or output_dir) if operation == "delete" else output_dir,
+                              jobs=1, column_stats=column_stats, where=job.get("where") or None,
+                              sort=job.get("sort"), collation=collation, memory_budget=memory_budget,
+                              checkpoint_interval=checkpoint_interval, resume=resume)
+    started = time.perf_counter()
+    try:
+        rows = run_operation(operation, args, None if operation == "delete" else output)
+    except Exception as e:
+        rows = None
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    if rows is None:
+        result["status"] = "failed"
+    else:
+        result["rows"] = rows
+    return result
+
+
+def run_batch(manifest_path, args):
+    """
+    Runs the jobs of a manifest in a pool of args.jobs worker processes, or only
+    every N-th job from the i-th with --shard i/N, and writes a results log.
+    """
+    if not os.path.isfile(manifest_path):
+        print(f"❌ Batch manifest not found: {manifest_path}")
+        return
+    jobs = list(enumerate(load_batch_manifest(manifest_path), 1))
+    log_suffix = "_results"
+    if args.shard:
+        shard = parse_shard(args.shard)
+        if shard is None:
+            print(f"❌ Invalid shard '{args.shard}', expected i/N with 1 <= i <= N.")
+            return
+        i, n = shard
+        jobs = [(job_no, job) for job_no, job in jobs if (job_no - 1) % n == i - 1]
+        log_suffix = f"_results_shard_{i}_of_{n}"
+    print(f"📋 Running {len(jobs)} job(s) from {os.path.basename(manifest_path)} with {max(args.jobs, 1)} worker(s)")
+
+    output_dir = args.output_dir or None
+    tasks = [(job_no, job, output_dir, args.column_stats, ENCODING_SAMPLE_BYTES, BUILD_INDEX, PIPELINE, CACHE, CACHE_DIR,
+              args.checkpoint_interval, args.resume, args.memory_budget)
+             for job_no, job in jobs]
+    results = []
+    executor = ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+    try:
+        for result in (executor.map(run_batch_job, tasks) if executor else map(run_batch_job, tasks)):
+            results.append(result)
+            mark = "✅" if result["status"] == "ok" else "❌"
+            detail = f"{result['rows']} rows" if result["status"] == "ok" else result["error"] or result["status"]
+            print(f"{mark} Job {result['job']} ({result['operation']} {result['input']}): {detail} in {result['seconds']}s")
+    finally:
+        if executor:
+            executor.shutdown()
+
+    headers = ["Job", "Operation", "Input", "Output", "Status", "Rows", "Seconds", "Error"]
+    log_rows = [(str(r["job"]), r["operation"], r["input"], r["output"], r["status"], str(r["rows"]), str(r["seconds"]), r["error"])
+                for r in results]
+    log_path = get_output_path(manifest_path, log_suffix, ".csv", args.output_dir)
+    export_data(headers, log_rows, log_path, fmt="csv", encoding="utf-8-sig")
+    failed = sum(1 for r in results if r["status"] != "ok")
+    print(f"📝 Batch results written to {log_path}")
+    print(f"{'⚠️' if failed else '✅'} {len(results) - failed} job(s) succeeded, {failed} failed.")
+
 
     # === Argument Parsing ===
 
@@ -620,12 +4239,46 @@ def get_arguments():
     parser.add_argument("--tsv", nargs="?", const=True, metavar="OUTPUT", help="Export output as CSV(Tab Separated Vlaue)")
     parser.add_argument("--dat", nargs="?", const=True, metavar="OUTPUT", help="Export output as DAT")
     parser.add_argument("-c", "--compare", action="store_true", help="Compare two DAT files")
-    parser.add_argument("-m", "--mapping", metavar="MAPPING_FILE", help="Header mapping file for comparison")
+    parser.add_argument("-m", "--mapping", metavar="MAPPING_FILE", help="Header mapping file for comparison, or for the overlay headers of --join")
+    parser.add_argument("--diff-summary", action="store_true", help="Write only difference counts per field and per row range (or status) instead of every difference")
+    parser.add_argument("--key", metavar="FIELD", help="Compare records matched on this field (e.g. BEGBATES) instead of by position")
+    parser.add_argument("--encoding-sample", type=int, metavar="MB", help="Scan only the first MB of each file when telling Windows-1252 from Latin-1, instead of the whole file")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_MB, metavar="MB", help=f"Memory for in-memory indexes (compare, join), sorts and dedupe digests before spilling to temp files (default {DEFAULT_MEMORY_BUDGET_MB})")
     parser.add_argument("-r", "--replace-header", metavar="HEADER_MAPPING_FILE", help="Replace headers using a mapping file")
     parser.add_argument("-merge", action="store_true", help="Merge multiple DAT files into groups")
-    parser.add_argument("-delete", nargs="?", metavar="DELETE_FILE", help="Delete rows based on field values")
+    parser.add_argument("-delete", nargs="?", const=True, metavar="DELETE_FILE", help="Delete rows based on field values (or on --where alone)")
     parser.add_argument("-select", nargs="?", metavar="SELECT_FILE", help="Select rows based on field values")
+    parser.add_argument("--sort", metavar="FIELD[,FIELD...]", help="Sort rows by these fields, spilling sorted runs to temp files beyond --memory-budget")
+    parser.add_argument("--collation", choices=SORT_COLLATIONS, default="natural",
+                        help="How --sort compares values: natural (numbers by value, dates by date, case-insensitive), bates (prefix, then number) or text (default natural)")
+    parser.add_argument("--join", metavar="OVERLAY", help="Add the fields of an OVERLAY DAT file to the input's rows, matched on --on FIELD (-m renames and picks overlay fields)")
+    parser.add_argument("--on", metavar="FIELD", help="Key field that matches input and overlay rows for --join")
+    parser.add_argument("--join-type", choices=JOIN_TYPES, default="left",
+                        help="left keeps input rows without an overlay match (with empty overlay fields), inner drops them (default left)")
+    parser.add_argument("--dedupe-key", nargs="?", const=True, metavar="FIELD",
+                        help="With -merge or a conversion, keep only the first row of each FIELD value (of each whole record without FIELD) and write the others to a _duplicates file")
+    parser.add_argument("--where", metavar="EXPR", help='Only keep (or with -delete, only delete) rows matching EXPR, e.g. "CUSTODIAN = Smith and DATESENT >= 2020-01-01"')
+    parser.add_argument("--cache", action="store_true", help="Read DAT files through a binary column cache, building it on first use")
+    parser.add_argument("--cache-dir", metavar="DIR", help=f"Directory of the column cache (default $DAT_CACHE_DIR or {CACHE_DIR})")
+    parser.add_argument("--build-cache", action="store_true", help="Build the column cache of the input file(s)")
+    parser.add_argument("--prune-cache", nargs="?", type=float, const=CACHE_SIZE_MB, metavar="MB",
+                        help=f"Delete out-of-date cache files, then the least recently used ones until the cache fits in MB (default {CACHE_SIZE_MB})")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Read, parse and write in separate threads, so I/O waits overlap with parsing (helps most on network shares)")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, metavar="SECONDS",
+                        help=f"Save a checkpoint of convert, select, replace-header and merge runs every SECONDS (default {CHECKPOINT_INTERVAL}, 0 turns it off)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its last checkpoint (DAT to DAT runs that copy the body through save none and start again)")
+    parser.add_argument("--batch", metavar="MANIFEST", help="Run the jobs listed in a CSV or JSON manifest (operation, input, output, format, file, where, sort, collation)")
+    parser.add_argument("--shard", metavar="i/N", help="With --batch, run only every N-th job starting from job i")
+    parser.add_argument("--column-stats", nargs="?", const=True, metavar="JSON", help="Print per-column statistics of the rows read (lengths, empty and approximate distinct values, values over Excel's cell limit) and optionally write them to a JSON file")
+    parser.add_argument("--stats", nargs="?", const=True, metavar="JSON", help="Print time per stage, throughput and peak memory at the end, and optionally write them to a JSON file")
+    parser.add_argument("--progress", action="store_true", help="Show progress with an ETA while files are read")
+    parser.add_argument("--profile-stage", choices=STAGES, metavar="STAGE", help=f"Profile one stage with cProfile ({', '.join(STAGES)})")
+    parser.add_argument("--index", action="store_true", help=f"Write a {INDEX_SUFFIX} record index next to each file read in full")
+    parser.add_argument("--inspect", action="store_true", help="Print the encoding, row count and headers of the input file")
+    parser.add_argument("--row", type=int, metavar="N", help="Print row N of the input file (row 2 is the first record after the header)")
     parser.add_argument("-o", "--output-dir", metavar="DIR", help="Directory for output files")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N", help="Number of worker processes (default 1)")
 
     try:
         return parser.parse_args()
@@ -641,6 +4294,15 @@ def get_arguments():
 
 if __name__ == '__main__':
     args = get_arguments()
+    if args.encoding_sample is not None:
+        ENCODING_SAMPLE_BYTES = max(args.encoding_sample, 0) * 1024 * 1024
+    BUILD_INDEX = args.index
+    PIPELINE = args.pipeline
+    CACHE = args.cache
+    if args.cache_dir:
+        CACHE_DIR = args.cache_dir
+    if args.stats or args.progress or args.profile_stage:
+        METRICS = RunMetrics(args.progress, args.profile_stage)
 
     # Check if a primary operation is specified
     # Auto-assign input_file to merge if merge flag is set but value is None
@@ -648,6 +4310,21 @@ if __name__ == '__main__':
         args.merge = args.input_file
         args.input_file = None
         Merge_dats(args.merge, args)
+    elif args.build_cache or args.prune_cache is not None:
+        for path in (args.input_file, args.input_file2) if args.build_cache else ():
+            if path:
+                build_cache_command(path)
+        if args.build_cache and not args.input_file:
+            print("❌ Please provide the input file along with --build-cache.")
+        if args.prune_cache is not None:
+            prune_column_cache(args.prune_cache)
+    elif args.inspect or args.row is not None:
+        if not args.input_file:
+            print("❌ Please provide the input file along with --inspect or --row.")
+        elif args.row is not None:
+            print_dat_row(args.input_file, args.row)
+        else:
+            inspect_dat(args.input_file)
     elif args.compare:
         if not args.input_file2:
             print("Error: You must provide a second DAT file for comparison.")
@@ -656,67 +4333,53 @@ if __name__ == '__main__':
                 map_dic = load_mapping_file(args.mapping)
             else:
                 map_dic = None
-            headers, diffs = compare_dat_files(args.input_file, args.input_file2, map_dic)
-            if diffs: # Only export if there are differences
+            headers, diffs = compare_dat_files(args.input_file, args.input_file2, map_dic, args.key, args.memory_budget)
+            first_diff = next(diffs, None) if diffs is not None else None
+            if first_diff is not None: # Only export if there are differences
                 fmt = "dat"
                 if args.tsv:
                     fmt = "tsv"
                 elif args.csv:
                     fmt = "csv"
-                output_path = get_output_path(args.input_file, "_diff", "." + fmt, args.output_dir)
-                export_data(headers, diffs, output_path, fmt=fmt)
+                diffs = itertools.chain([first_diff], diffs)
+                if args.diff_summary:
+                    headers, diffs = summarize_diffs(headers, diffs)
+                    output_path = get_output_path(args.input_file, "_diff_summary", "." + fmt, args.output_dir)
+                else:
+                    output_path = get_output_path(args.input_file, "_diff", "." + fmt, args.output_dir)
+                export_data(headers, diffs, output_path, fmt=fmt) # Differences stream straight to the output
             else:
                 print("No differences found during comparison.")
+    elif args.batch:
+        run_batch(args.batch, args)
     elif args.replace_header:
         # Ensure input_file is provided for replace-header
         if not args.input_file:
             print("Error: An input file is required for --replace-header.")
             sys.exit(2)
-        
-        input_file_path = args.input_file # Define input_file_path here
-        
-        # Detect input encoding
-        Encode = detect_encoding(args.input_file, os.path.basename(args.input_file))
-        header_map = get_mapping_dict(args.replace_header)
-        new_headers, rows = replace_header_and_collect(args.input_file, header_map, Encode)
-        
-        fmt = "dat"
-        if args.tsv:
-            fmt = "tsv"
-        elif args.csv:
-            fmt = "csv"
-        
-        # Determine output path
-        output_path = get_output_path(args.input_file, "_Replaced", "." + fmt, args.output_dir)
-        
-        export_data(new_headers, rows, output_path, fmt=fmt, encoding=Encode)
+        run_operation("replace-header", args)
 
     elif args.delete:
         if not args.input_file:
             print("❌ Please provide the input file along with --delete option.")
         else:
-            delete_rows(args.input_file, args.delete, args)
+            run_operation("delete", args)
 
     elif args.select:
         if not args.input_file:
             print("❌ Please provide the input file along with --select option.")
         else:
-            # Detect input encoding
-            Encode = detect_encoding(args.input_file, os.path.basename(args.input_file))
-            selected_headers = []
-            with open(args.select, encoding=detect_encoding(args.select, os.path.basename(args.select))) as f:
-                selected_headers = [line.strip() for line in f if line.strip()]
-            if not selected_headers:
-                print("❌ No headers selected in the selection file.")
-                sys.exit(2)
-            new_headers, rows = select_fields_and_collect(args.input_file, selected_headers, Encode)
-            fmt = "dat"
-            if args.tsv:
-                fmt = "tsv"
-            elif args.csv:
-                fmt = "csv"
-            output_path = get_output_path(args.input_file, "_selected", "." + fmt, args.output_dir)
-            export_data(new_headers, rows, output_path, fmt=fmt, encoding=Encode)
+            run_operation("select", args)
+    elif args.sort:
+        if not args.input_file:
+            print("❌ Please provide the input file along with --sort option.")
+        else:
+            run_operation("sort", args)
+    elif args.join:
+        if not args.input_file or not args.on:
+            print("❌ Please provide the input file and the key field (--on) along with --join option.")
+        else:
+            run_operation("join", args)
     elif args.tsv or args.csv or args.dat:
         if not args.input_file:
             print("\n" + "=" * 60)
@@ -725,18 +4388,12 @@ if __name__ == '__main__':
             print("  For help, run:\n  python Main_Refactored.py --help")
             print("=" * 60 + "\n")
             sys.exit(2)
-        Encode = detect_encoding(args.input_file, os.path.basename(args.input_file))
-        headers, rows = replace_header_and_collect(args.input_file, {}, Encode)
-        fmt = "dat"
-        if args.tsv:
-            fmt = "tsv"
-        elif args.csv:
-            fmt = "csv"
-        output_path = get_output_path(args.input_file, "_converted", "." + fmt, args.output_dir)
-        export_data(headers, rows, output_path, fmt=fmt, encoding=Encode)
+        run_operation("convert", args)
     else: # No specific operation or input file provided
         print("\n" + "=" * 60)
         print("  ❌  Missing required arguments!\n")
         print("  Please provide an input file or use the --merge option.\n")
         print("  For help, run:\n  python Main_Refactored.py --help")
-        print("=" * 60 + "\n")
\ No newline at end of file
+        print("=" * 60 + "\n")
+    if METRICS is not None:
+        METRICS.finish(args.stats, print_stages=bool(args.stats))
@@ -0,0 +1,270 @@
+"""
+Benchmark for Main.py.
+
+Generates deterministic synthetic Concordance DAT files, runs each CLI operation on
+them in a fresh process and records wall time, throughput and peak memory. Results
+are written to a JSON file that later runs can be compared against with --baseline.
+
+    python benchmark.py --rows 20000 -o bench.json
+    python benchmark.py --rows 20000 -o bench_new.json --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# === Global Constants ===
+QUOTE_CHAR = '\xfe'  # Quote character used to enclose fields.
+FIELD_SEP = '\x14'  # Field separator (DC4)
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Main.py")
+ENCODINGS = ["utf-8", "utf-16", "cp1252", "latin-1"]
+OPERATIONS = ["convert-csv", "convert-dat", "select", "delete", "replace-header", "compare", "merge"]
+# Characters that only some encodings can hold, used in free-text values
+SPECIAL_TEXT = {
+    "utf-8": "naïve café – “Ünïcødé” ✓",
+    "utf-16": "naïve café – “Ünïcødé” ✓",
+    "cp1252": "naïve café – “quoted” €",
+    "latin-1": "naïve café ± ¼ «quoted»",
+}
+WORDS = ("contract", "invoice", "meeting", "privileged", "draft", "review", "schedule", "payment",
+         "attachment", "email", "report", "summary", "confidential", "agreement", "notes", "memo")
+
+
+# === Synthetic DAT Generator ===
+def dat_headers(cols):
+    """Header names: bates range, a few metadata fields, then text fields."""
+    fixed = ["BEGBATES", "ENDBATES", "CUSTODIAN", "DATESENT", "SUBJECT", "OCRTEXT"]
+    return fixed[:cols] + [f"FIELD{i}" for i in range(len(fixed), cols)]
+
+
+def dat_value(rng, header, row, encoding, multiline_ratio, long_ratio, long_length):
+    if header in ("BEGBATES", "ENDBATES"):
+        return f"ABC{row:08d}"
+    if header == "CUSTODIAN":
+        return rng.choice(("Smith, John", "Doe, Jane", "Admin", ""))
+    if header == "DATESENT":
+        return f"{rng.randint(2001, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    r = rng.random()
+    if r < long_ratio or (header == "OCRTEXT" and r < long_ratio * 10):
+        # OCR-like text, sometimes longer than Excel's cell limit
+        words = " ".join(rng.choice(WORDS) for _ in range(long_length // 8))
+        return (words + "\r\n") * 2 + SPECIAL_TEXT[encoding]
+    if r < long_ratio + multiline_ratio:
+        return f"{rng.choice(WORDS)} line one\r\nline two {row}\nline three"
+    if r < 0.3:
+        return ""
+    if r < 0.35:
+        return SPECIAL_TEXT[encoding]
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 6)))
+
+
+def generate_dat(path, rows, cols, encoding="utf-8", seed=1, multiline_ratio=0.05, long_ratio=0.002,
+                 long_length=40000, change_every=0):
+    """
+    Writes a DAT file of rows records and cols fields. The same arguments always give
+    the same bytes. With change_every set, every change_every-th record gets a changed
+    SUBJECT value, for compare runs against the unchanged file.
+    """
+    rng = random.Random(seed)
+    headers = dat_headers(cols)
+    sep = QUOTE_CHAR + FIELD_SEP + QUOTE_CHAR
+    with open(path, "w", encoding=encoding, newline="") as f:
+        f.write(f"{QUOTE_CHAR}{sep.join(headers)}{QUOTE_CHAR}\r\n")
+        for row in range(rows):
+            values = [dat_value(rng, h, row, encoding, multiline_ratio, long_ratio, long_length) for h in headers]
+            if change_every and row % change_every == 0 and len(values) > 4:
+                values[4] = "changed " + values[4]
+            f.write(f"{QUOTE_CHAR}{sep.join(values)}{QUOTE_CHAR}\r\n")
+    return path
+
+
+# === Operation Runner ===
+def run_measured(cmd, cwd):
+    """
+    Runs a command and returns (seconds, peak resident memory in MB or None, returncode).
+    Peak memory needs os.wait4 and is not measured on Windows.
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - started
+        proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+        return seconds, round(peak_mb, 1), proc.returncode
+    proc.wait()
+    return time.perf_counter() - started, None, proc.returncode
+
+
+def prepare_inputs(work_dir, encoding, args):
+    """Generates the input files of one encoding and the list files the operations need."""
+    name = encoding.replace("-", "")
+    headers = dat_headers(args.cols)
+    inputs = {"main": generate_dat(os.path.join(work_dir, f"{name}.dat"), args.rows, args.cols, encoding, args.seed,
+                                   args.multiline_ratio, args.long_ratio, args.long_length)}
+    inputs["changed"] = generate_dat(os.path.join(work_dir, f"{name}_changed.dat"), args.rows, args.cols, encoding,
+                                     args.seed, args.multiline_ratio, args.long_ratio, args.long_length, change_every=100)
+    inputs["select"] = os.path.join(work_dir, "select.txt")
+    with open(inputs["select"], "w", encoding="utf-8") as f:
+        f.write("\n".join(headers[:2] + headers[4:5]) + "\n")
+    inputs["delete"] = os.path.join(work_dir, "delete.txt")
+    with open(inputs["delete"], "w", encoding="utf-8") as f:
+        f.write("BEGBATES\n" + "\n".join(f"ABC{row:08d}" for row in range(0, args.rows, 10)) + "\n")
+    inputs["mapping"] = os.path.join(work_dir, "mapping.csv")
+    with open(inputs["mapping"], "w", encoding="utf-8") as f:
+        f.write("BEGBATES,BEGDOC\nENDBATES,ENDDOC\n")
+    inputs["merge"] = os.path.join(work_dir, f"{name}_merge.csv")
+    with open(inputs["merge"], "w", encoding="utf-8") as f:
+        f.write(f"{inputs['main']}\n{inputs['changed']}\n{inputs['main']}\n")
+    return inputs
+
+
+def operation_command(operation, inputs):
+    """Returns (Main.py arguments, input files read) for an operation."""
+    main = inputs["main"]
+    if operation == "convert-csv":
+        return [main, "--csv"], [main]
+    if operation == "convert-dat":
+        return [main, "--dat"], [main]
+    if operation == "select":
+        return [main, "-select", inputs["select"], "--dat"], [main]
+    if operation == "delete":
+        return [main, "-delete", inputs["delete"], "--dat"], [main]
+    if operation == "replace-header":
+        return [main, "-r", inputs["mapping"], "--dat"], [main]
+    if operation == "compare":
+        return [main, inputs["changed"], "-c", "--csv"], [main, inputs["changed"]]
+    if operation == "merge":
+        return ["-merge", inputs["merge"], "--dat"], [main, inputs["changed"], main]
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def run_benchmarks(args):
+    """
+    Runs every operation on every encoding. Returns the results of the operations,
+    and the failures: operations whose runs all exited with an error, which are left
+    out of the results so they are never reported as throughput.
+    """
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="dat_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    failures = []
+    try:
+        for encoding in args.encodings:
+            print(f"🏗️ Generating {args.rows} rows x {args.cols} fields in {encoding}...")
+            inputs = prepare_inputs(work_dir, encoding, args)
+            for operation in args.operations:
+                cmd_args, read_files = operation_command(operation, inputs)
+                input_bytes = sum(os.path.getsize(p) for p in read_files)
+                runs = []
+                for _ in range(args.repeat):
+                    out_dir = tempfile.mkdtemp(prefix="out_", dir=work_dir)
+                    cmd = [sys.executable, args.main] + cmd_args + ["-o", out_dir]
+                    if args.jobs > 1:
+                        cmd += ["-j", str(args.jobs)]  # Only then, so a Main.py without -j can be measured
+                    runs.append(run_measured(cmd, work_dir))
+                    shutil.rmtree(out_dir, ignore_errors=True)
+                succeeded = [run for run in runs if run[2] == 0]
+                if not succeeded:
+                    returncode = runs[-1][2]
+                    failures.append({"operation": operation, "encoding": encoding, "returncode": returncode})
+                    print(f"❌ {operation:<15} {encoding:<8} failed with exit code {returncode}, left out of the results")
+                    continue
+                if len(succeeded) < len(runs):
+                    print(f"⚠️ {operation:<15} {encoding:<8} {len(runs) - len(succeeded)} of {len(runs)} runs failed and are not counted")
+                seconds, peak_mb, returncode = min(succeeded, key=lambda run: run[0])  # Best of the repeats
+                result = {
+                    "operation": operation,
+                    "encoding": encoding,
+                    "input_mb": round(input_bytes / 1e6, 2),
+                    "rows": args.rows * len(read_files),
+                    "seconds": round(seconds, 3),
+                    "mb_per_s": round(input_bytes / 1e6 / seconds, 2),
+                    "rows_per_s": round(args.rows * len(read_files) / seconds),
+                    "peak_rss_mb": max((run[1] for run in succeeded if run[1] is not None), default=None),
+                    "returncode": returncode,
+                }
+                results.append(result)
+                print(f"✅ {operation:<15} {encoding:<8} {result['seconds']:>8.3f}s {result['mb_per_s']:>8.2f} MB/s "
+                      f"{result['rows_per_s']:>9} rows/s  peak {result['peak_rss_mb']} MB")
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results, failures
+
+
+# === Reporting ===
+def compare_with_baseline(results, baseline_path):
+    """
+    Prints the time of each operation relative to the same operation in a baseline
+    file. Operations that failed in either run are skipped.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["operation"], r["encoding"]): r for r in json.load(f)["results"]
+                    if r.get("returncode", 0) == 0}  # Older files kept failed runs in the results
+    print(f"\n📊 Compared with {baseline_path} (ratio < 1 is faster):")
+    for r in results:
+        old = baseline.get((r["operation"], r["encoding"]))
+        if old is None or not old["seconds"]:
+            print(f"   {r['operation']:<15} {r['encoding']:<8} no successful baseline run")
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        mark = "⚠️" if ratio > 1.1 else "  "
+        print(f"{mark} {r['operation']:<15} {r['encoding']:<8} {old['seconds']:>8.3f}s -> {r['seconds']:>8.3f}s  x{ratio:.2f}")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark Main.py on synthetic DAT files")
+    parser.add_argument("--rows", type=int, default=20000, help="Records per generated file (default 20000)")
+    parser.add_argument("--cols", type=int, default=12, help="Fields per record (default 12)")
+    parser.add_argument("--seed", type=int, default=1, help="Generator seed (default 1)")
+    parser.add_argument("--multiline-ratio", type=float, default=0.05, help="Share of values with embedded line breaks")
+    parser.add_argument("--long-ratio", type=float, default=0.002, help="Share of very long text values")
+    parser.add_argument("--long-length", type=int, default=40000, help="Approximate length of long text values")
+    parser.add_argument("--encodings", type=lambda s: s.split(","), default=ENCODINGS, help=f"Comma separated (default {','.join(ENCODINGS)})")
+    parser.add_argument("--operations", type=lambda s: s.split(","), default=OPERATIONS, help=f"Comma separated (default {','.join(OPERATIONS)})")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per operation; the fastest is reported")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Passed to Main.py -j when above 1")
+    parser.add_argument("--main", default=MAIN_PATH, help="Main.py to benchmark")
+    parser.add_argument("--work-dir", help="Directory for generated files (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files in the temporary directory")
+    parser.add_argument("--baseline", metavar="JSON", help="Earlier results to compare against")
+    parser.add_argument("-o", "--output", default="benchmark_results.json", help="Results file (default benchmark_results.json)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_arguments()
+    unknown = [op for op in args.operations if op not in OPERATIONS]
+    if unknown:
+        print(f"❌ Unknown operation(s): {', '.join(unknown)}. Choose from {', '.join(OPERATIONS)}.")
+        sys.exit(2)
+    results, failures = run_benchmarks(args)
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "main": os.path.abspath(args.main),
+            "rows": args.rows,
+            "cols": args.cols,
+            "seed": args.seed,
+            "jobs": args.jobs,
+            "repeat": args.repeat,
+        },
+        "results": results,
+        "failures": failures,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {args.output}")
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)